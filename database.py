@@ -1,10 +1,11 @@
-from sqlmodel import Session, SQLModel, create_engine
-from typing import Generator
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from typing import AsyncGenerator
 import os
 from dotenv import load_dotenv
 from urllib.parse import quote_plus
 from schema import air_quality_schema,station_schema
-import os
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,24 +17,38 @@ POSTGRES_SERVER = os.getenv("POSTGRES_SERVER", "10.170.0.2")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")  # default postgres port
 POSTGRES_DB = os.getenv("POSTGRES_DB", "postgres")
 
-# URL-encode the password
-encoded_password = quote_plus(POSTGRES_PASSWORD)
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{encoded_password}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# DATABASE_URL overrides the PostgreSQL settings, e.g. sqlite+aiosqlite:///./aqf.sqlite3 when running locally
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    # URL-encode the password
+    encoded_password = quote_plus(POSTGRES_PASSWORD)
+    DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{encoded_password}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+
+# Pool sizes are per worker process, so the server sees up to workers x (size + overflow) connections
+pool_options = {}
+if not DATABASE_URL.startswith("sqlite"):
+    pool_options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),  # Connection pool size
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),  # Additional connections allowed beyond pool_size
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),  # Seconds to wait for a free connection
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),  # Replace connections before the server's idle timeout
+    }
 
 # Create engine
-engine = create_engine(
+engine = create_async_engine(
     DATABASE_URL,
-    # pool_size=20,  # Connection pool size
-    # max_overflow=10,  # Additional connections allowed beyond pool_size
-    # pool_pre_ping=True,  # Test connections for health before use
-    echo=True  # Log SQL queries (useful for development)
+    pool_pre_ping=True,  # Test connections for health before use
+    echo=os.getenv("DB_ECHO", "false").lower() == "true",  # Log SQL queries (useful for development)
+    **pool_options,
 )
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 # Function to create database tables
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+async def create_db_and_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
 
 # Dependency to get DB session
-def get_session() -> Generator[Session, None, None]:
-    with Session(engine) as session:
-        yield session
\ No newline at end of file
+async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    async with async_session() as session:
+        yield session
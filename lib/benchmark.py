@@ -0,0 +1,225 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import torch
+
+from lib.images_to_patches import images_to_patches, load_station_cells
+from lib.model_architecture import AQI_CNNLSTM, FSP_CNNLSTM
+from lib.prediction import (
+    AQI_CHANNEL,
+    AQI_MODEL_PATH,
+    AQI_PATCH_SIZE,
+    AQI_SCALERS_PATH,
+    FSP_MODEL_PATH,
+    FSP_PATCH_SIZE,
+    FSP_SCALERS_PATH,
+    STATIONS_CSV,
+    ar_to_aqhi,
+    format_output,
+    load_images,
+    load_model,
+    load_scalers,
+    load_station_names,
+    predict_aqi,
+    predict_fsp,
+    transform_with_channel_scalers,
+    transform_with_scalers,
+)
+
+# Production input: 48 hourly frames, 16 channels on the 45 x 65 grid
+PRODUCTION_SHAPE = (48, 16, 45, 65)
+DEFAULT_BASELINE_PATH = "./lib/benchmark_baseline.json"
+
+
+def _rss_bytes() -> int:
+    # Current resident set size (Linux); falls back to the peak where /proc is unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return _peak_rss_bytes()
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB on Linux
+
+
+def write_synthetic_images(path: str, shape: tuple = PRODUCTION_SHAPE, seed: int = 0) -> str:
+    """
+    Writes a float32 tensor of the production shape whose channels follow the
+    AQI scalers' fitted mean and spread, so scaled inputs look like real ones.
+    """
+    rng = np.random.default_rng(seed)
+    try:
+        scalers = load_scalers(AQI_SCALERS_PATH)
+        mean = np.array([sc.mean_[0] for sc in scalers], dtype=np.float32)
+        std = np.array([sc.scale_[0] for sc in scalers], dtype=np.float32)
+    except (OSError, AttributeError):
+        mean, std = np.zeros(shape[1], dtype=np.float32), np.ones(shape[1], dtype=np.float32)
+
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+    for t in range(shape[0]):
+        out[t] = mean[:, None, None] + std[:, None, None] * rng.standard_normal(shape[1:], dtype=np.float32)
+    out.flush()
+    del out
+    return path
+
+
+def write_random_weights(directory: str) -> tuple[str, str]:
+    # Stand-in weights with the production architecture for hosts without the trained files
+    torch.manual_seed(0)
+    aqi_path, fsp_path = os.path.join(directory, "aqi.pth"), os.path.join(directory, "fsp.pth")
+    aqi = AQI_CNNLSTM(in_channels=16, num_residual_units=4, lstm_hidden_size=128, num_lstm_layers=1, seq_length=48, pred_len=24)
+    fsp = FSP_CNNLSTM(n_stations=17, in_channels=15, cnn_embed=256, lstm_hidden=64, pred_len=24, embed_dim=16)
+    torch.save(aqi.state_dict(), aqi_path)
+    torch.save(fsp.state_dict(), fsp_path)
+    return aqi_path, fsp_path
+
+
+def measure(fn: Callable[[], Any], repeats: int) -> tuple[Any, Dict[str, float]]:
+    """
+    Runs fn repeats times; returns its last result with median/min wall time,
+    Python heap allocations (tracemalloc peak; torch's allocator is not
+    traced), RSS growth and the process peak RSS afterwards.
+    """
+    times, alloc_peaks, rss_deltas = [], [], []
+    result = None
+    for _ in range(repeats):
+        result = None
+        gc.collect()
+        rss_before = _rss_bytes()
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+        alloc_peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        rss_deltas.append(_rss_bytes() - rss_before)
+    return result, {
+        "wall_seconds": statistics.median(times),
+        "min_wall_seconds": min(times),
+        "alloc_peak_mb": max(alloc_peaks) / 1e6,
+        "rss_delta_mb": max(rss_deltas) / 1e6,
+        "peak_rss_mb": _peak_rss_bytes() / 1e6,
+    }
+
+
+def run_benchmark(images_path: str, aqi_model_path: str, fsp_model_path: str, repeats: int = 5) -> Dict[str, Any]:
+    """
+    Times every stage of forecast_aq() separately on CPU, in pipeline order,
+    each stage consuming the previous stage's output.
+    """
+    device = torch.device("cpu")
+    stations = load_station_cells(STATIONS_CSV)
+    station_names = load_station_names(STATIONS_CSV)
+    aqi_scalers = load_scalers(AQI_SCALERS_PATH)
+    fsp_scaler = load_scalers(FSP_SCALERS_PATH)
+    fsp_channels = np.delete(np.arange(PRODUCTION_SHAPE[1]), AQI_CHANNEL)
+    stages = {}
+
+    images, stages["load_images"] = measure(lambda: load_images(images_path), repeats)
+    aqi_patches, stages["images_to_patches_aqi"] = measure(lambda: images_to_patches(images, stations, AQI_PATCH_SIZE), repeats)
+    fsp_patches, stages["images_to_patches_fsp"] = measure(
+        lambda: images_to_patches(images, stations, FSP_PATCH_SIZE, channels=fsp_channels), repeats
+    )
+    X_aqi, stages["transform_with_channel_scalers"] = measure(lambda: transform_with_channel_scalers(aqi_patches, aqi_scalers), repeats)
+    X_fsp, stages["transform_with_scalers"] = measure(lambda: transform_with_scalers(fsp_patches, fsp_scaler), repeats)
+    X_aqi, X_fsp = X_aqi.transpose(2, 0, 1, 3, 4), X_fsp.transpose(2, 0, 1, 3, 4)
+    (aqi_model, fsp_model), stages["load_model"] = measure(lambda: load_model(aqi_model_path, fsp_model_path, device), repeats)
+    ar, stages["predict_aqi"] = measure(lambda: predict_aqi(aqi_model, X_aqi, device), repeats)
+    fsp, stages["predict_fsp"] = measure(lambda: predict_fsp(fsp_model, X_fsp, device), repeats)
+    aqhi, stages["ar_to_aqhi"] = measure(lambda: ar_to_aqhi(ar), repeats)
+    _, stages["format_output"] = measure(lambda: format_output(aqhi, fsp, station_names), repeats)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+        },
+        "input_shape": list(images.shape),
+        "repeats": repeats,
+        "stages": {name: {k: round(v, 6) for k, v in m.items()} for name, m in stages.items()},
+        "total_wall_seconds": round(sum(m["wall_seconds"] for m in stages.values()), 6),
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2, min_seconds: float = 0.005) -> list[str]:
+    """
+    Stages whose median wall time grew by more than tolerance (relative) over
+    the baseline. Stages faster than min_seconds in both runs are ignored.
+    """
+    regressions = []
+    for name, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if previous is None:
+            continue
+        before, after = previous["wall_seconds"], current["wall_seconds"]
+        if max(before, after) < min_seconds:
+            continue
+        if after > before * (1 + tolerance):
+            regressions.append(f"{name}: {before:.4f}s -> {after:.4f}s (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _print_table(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(f"{'stage':32} {'wall s':>9} {'base s':>9} {'alloc MB':>9} {'rss +MB':>8} {'peak MB':>8}")
+    for name, m in report["stages"].items():
+        base = (baseline or {}).get("stages", {}).get(name, {}).get("wall_seconds")
+        base_str = f"{base:9.4f}" if base is not None else f"{'-':>9}"
+        print(f"{name:32} {m['wall_seconds']:9.4f} {base_str} {m['alloc_peak_mb']:9.1f} {m['rss_delta_mb']:8.1f} {m['peak_rss_mb']:8.0f}")
+    print(f"{'total':32} {report['total_wall_seconds']:9.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the forecast pipeline (offline, synthetic input)")
+    parser.add_argument("--images", help="input tensor (.npy); a synthetic production-shape tensor is generated when omitted")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--random-weights", action="store_true", help="use randomly initialised weights instead of lib/*.pth")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the report to --baseline")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown per stage")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images_path = args.images or write_synthetic_images(os.path.join(tmp, "past48h_tensor.npy"))
+        aqi_path, fsp_path = AQI_MODEL_PATH, FSP_MODEL_PATH
+        if args.random_weights or not (os.path.exists(aqi_path) and os.path.exists(fsp_path)):
+            print("Benchmark: Using randomly initialised weights")
+            aqi_path, fsp_path = write_random_weights(tmp)
+        report = run_benchmark(images_path, aqi_path, fsp_path, repeats=args.repeats)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    _print_table(report, baseline)
+
+    for path in filter(None, [args.output, args.baseline if args.save_baseline else None]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark: Report written to {path}")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, tolerance=args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
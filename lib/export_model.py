@@ -0,0 +1,151 @@
+import copy
+import io
+import os
+import threading
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from lib.inference_settings import current_settings
+from lib.model_architecture import CNN, PM_ResidualUnit, ResidualUnit
+
+try:
+    import onnxruntime as ort
+except ImportError:  # onnxruntime is only needed for INFERENCE_BACKEND=onnxruntime
+    ort = None
+
+
+INFERENCE_BACKENDS = ("eager", "torchscript", "onnxruntime")
+N_STATIONS = 17
+SEQ_LENGTH = 48
+
+
+def fuse_for_inference(model: nn.Module) -> nn.Module:
+    """
+    Returns an eval-mode copy with every Conv+BatchNorm pair folded into a single
+    convolution and the unused PM_ResidualUnit skip_connection removed.
+    """
+    model = copy.deepcopy(model).eval()
+    for module in model.modules():
+        if isinstance(module, CNN):
+            module.initial_conv = fuse_conv_bn_eval(module.initial_conv, module.initial_bn)
+            module.initial_bn = nn.Identity()
+        elif isinstance(module, (ResidualUnit, PM_ResidualUnit)):
+            module.conv1 = fuse_conv_bn_eval(module.conv1, module.bn1)
+            module.bn1 = nn.Identity()
+            module.conv2 = fuse_conv_bn_eval(module.conv2, module.bn2)
+            module.bn2 = nn.Identity()
+            if isinstance(module, PM_ResidualUnit):
+                # Its output is never added back (the residual add is disabled)
+                module.skip_connection = None
+    return model
+
+
+def example_inputs(model_name: str, device=torch.device("cpu"), generator: torch.Generator | None = None) -> tuple:
+    # Drawn on the CPU (where generator lives) and moved to device
+    if model_name == "aqi":
+        return (torch.randn(N_STATIONS, SEQ_LENGTH, 16, 3, 3, generator=generator).to(device),)
+    return (
+        torch.randn(N_STATIONS, SEQ_LENGTH, 15, 15, 15, generator=generator).to(device),
+        torch.arange(N_STATIONS, device=device),
+    )
+
+
+def to_torchscript(model: nn.Module, inputs: tuple) -> torch.jit.ScriptModule:
+    with torch.no_grad():
+        traced = torch.jit.trace(fuse_for_inference(model), inputs)
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+def to_onnx_bytes(model: nn.Module, inputs: tuple) -> bytes:
+    names = ["patch_seq"] if len(inputs) == 1 else ["patch_seq", "station_idx"]
+    dynamic_axes = {name: {0: "batch"} for name in names + ["output"]}
+    buffer = io.BytesIO()
+    with torch.no_grad():
+        torch.onnx.export(
+            fuse_for_inference(model),
+            inputs,
+            buffer,
+            input_names=names,
+            output_names=["output"],
+            dynamic_axes=dynamic_axes,
+            dynamo=False,
+        )
+    return buffer.getvalue()
+
+
+class OnnxRuntimeModule:
+    """
+    Calls an ONNX Runtime CPU session with the same signature as the torch model.
+
+    The session uses the worker's inference thread counts (see
+    lib/inference_settings.py) rather than ONNX Runtime's default of every
+    core, and is rebuilt when apply_settings() or autotune changes them.
+    """
+
+    def __init__(self, onnx_model: bytes):
+        if ort is None:
+            raise ImportError("onnxruntime is not installed; use INFERENCE_BACKEND=eager or torchscript.")
+        self.onnx_model = onnx_model
+        self._lock = threading.Lock()
+        self._threads = None  # (intra_op, inter_op) the session was built with
+        self.session = self._session()
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def _session(self) -> "ort.InferenceSession":
+        settings = current_settings()
+        threads = (settings.intra_op_threads, settings.inter_op_threads)
+        with self._lock:
+            if threads != self._threads:
+                options = ort.SessionOptions()
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                options.intra_op_num_threads, options.inter_op_num_threads = threads
+                self.session = ort.InferenceSession(self.onnx_model, options, providers=["CPUExecutionProvider"])
+                self._threads = threads
+            return self.session
+
+    def __call__(self, *inputs: torch.Tensor) -> torch.Tensor:
+        feeds = {name: t.detach().cpu().numpy() for name, t in zip(self.input_names, inputs)}
+        return torch.from_numpy(self._session().run(None, feeds)[0])
+
+
+def build_backend(model: nn.Module, model_name: str, backend: str, device):
+    """
+    Wraps an eager model in the requested inference backend.
+    """
+    if backend == "eager":
+        return model
+    inputs = example_inputs(model_name, device)
+    if backend == "torchscript":
+        return to_torchscript(model, inputs)
+    if backend == "onnxruntime":
+        return OnnxRuntimeModule(to_onnx_bytes(model, tuple(t.cpu() for t in inputs)))
+    raise ValueError(f"Unknown INFERENCE_BACKEND '{backend}'. Expected one of {INFERENCE_BACKENDS}.")
+
+
+def parity_error(reference: nn.Module, candidate, model_name: str, device) -> float:
+    # Max absolute output difference between the eager model and a backend on random input
+    # A local generator keeps the input fixed without reseeding the process-wide torch RNG
+    inputs = example_inputs(model_name, device, generator=torch.Generator().manual_seed(0))
+    with torch.no_grad():
+        expected = reference(*inputs).cpu().numpy()
+        actual = candidate(*inputs).cpu().numpy()
+    return float(np.max(np.abs(expected - actual)))
+
+
+if __name__ == "__main__":
+    # Writes TorchScript and ONNX artefacts next to the eager weights
+    from lib.prediction import AQI_MODEL_PATH, FSP_MODEL_PATH, load_model
+
+    device = torch.device("cpu")
+    aqi_model, fsp_model = load_model(AQI_MODEL_PATH, FSP_MODEL_PATH, device)
+    for name, model, path in (("aqi", aqi_model, AQI_MODEL_PATH), ("fsp", fsp_model, FSP_MODEL_PATH)):
+        stem = os.path.splitext(path)[0]
+        inputs = example_inputs(name, device)
+        scripted = to_torchscript(model, inputs)
+        torch.jit.save(scripted, f"{stem}.ts.pt")
+        with open(f"{stem}.onnx", "wb") as f:
+            f.write(to_onnx_bytes(model, inputs))
+        print(f"{name}: saved {stem}.ts.pt and {stem}.onnx (torchscript parity {parity_error(model, scripted, name, device):.2e})")
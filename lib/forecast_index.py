@@ -0,0 +1,141 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from util.response_util import encode_json
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; the columnar format is also served as JSON
+    msgpack = None
+
+FORECAST_FIELDS = ("date", "time", "station", "aqi", "pm2_5")
+COLUMNAR_VARIABLES = ("aqi", "pm2_5")
+ROWS_MEDIA_TYPE = "application/json"
+COLUMNAR_MEDIA_TYPE = "application/vnd.aqf.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def forecast_media_types() -> List[str]:
+    # Offered representations, the default (row JSON) first
+    return [ROWS_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE] + ([MSGPACK_MEDIA_TYPE] if msgpack is not None else [])
+
+
+def encode_columnar(columns: Dict[str, Any], media_type: str) -> bytes:
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(columns, use_bin_type=True)
+    return encode_json(columns)
+
+
+@dataclass(frozen=True)
+class ForecastIndex:
+    """
+    Station-major view of one forecast run, built once from its columnar form
+    (format_columnar) when the forecast is published. aqi and pm2_5 are the
+    (stations, hours) arrays; rows[s][h] is station s's forecast hour h + 1 as
+    a format_output row, and row_bytes[s][h] its JSON, so a filtered response
+    joins the selected slices instead of scanning and re-encoding every row.
+    """
+    stations: tuple[str, ...]
+    positions: Dict[str, int]  # {lower-case station name: index into stations}
+    rows: tuple[tuple[Dict[str, Any], ...], ...]
+    row_bytes: tuple[tuple[bytes, ...], ...]
+    station_bytes: tuple[bytes, ...]  # b",".join(row_bytes[s])
+    hour_labels: tuple[str, ...]
+    aqi: np.ndarray
+    pm2_5: np.ndarray
+
+    @classmethod
+    def from_columnar(cls, columns: Dict[str, Any]) -> "ForecastIndex":
+        stations, hour_labels = tuple(columns["stations"]), tuple(columns["hours"])
+        aqi = np.asarray(columns["aqi"], dtype=np.int64).reshape(len(stations), len(hour_labels))
+        pm2_5 = np.asarray(columns["pm2_5"], dtype=np.int64).reshape(len(stations), len(hour_labels))
+        # Each label is JSON-encoded once; the integers format the same as encode_json
+        hour_json = [encode_json(label).decode("utf-8") for label in hour_labels]
+        rows, row_bytes = [], []
+        for station, aqi_row, pm2_5_row in zip(stations, aqi.tolist(), pm2_5.tolist()):
+            station_json = encode_json(station).decode("utf-8")
+            rows.append(tuple(
+                {"date": None, "time": label, "station": station, "aqi": a, "pm2_5": p}
+                for label, a, p in zip(hour_labels, aqi_row, pm2_5_row)
+            ))
+            row_bytes.append(tuple(
+                f'{{"date":null,"time":{label},"station":{station_json},"aqi":{a},"pm2_5":{p}}}'.encode("utf-8")
+                for label, a, p in zip(hour_json, aqi_row, pm2_5_row)
+            ))
+        return cls(
+            stations=stations,
+            positions={name.lower(): i for i, name in enumerate(stations)},
+            rows=tuple(rows),
+            row_bytes=tuple(row_bytes),
+            station_bytes=tuple(b",".join(chunks) for chunks in row_bytes),
+            hour_labels=hour_labels,
+            aqi=aqi,
+            pm2_5=pm2_5,
+        )
+
+    @property
+    def hours(self) -> int:
+        return len(self.hour_labels)
+
+    def station_indices(self, names: Optional[Sequence[str]]) -> List[int]:
+        """
+        Indices of the named stations (case-insensitive), in request order;
+        every station when names is empty. Raises ValueError for unknown names.
+        """
+        if not names:
+            return list(range(len(self.stations)))
+        unknown = [name for name in names if name.lower() not in self.positions]
+        if unknown:
+            raise ValueError(f"Unknown station(s): {', '.join(unknown)}. Expected one of {list(self.stations)}.")
+        return [self.positions[name.lower()] for name in names]
+
+    def _hour_range(self, hour_from: int, hour_to: Optional[int]) -> tuple[int, int]:
+        hour_to = self.hours if hour_to is None else min(hour_to, self.hours)
+        if not 1 <= hour_from <= hour_to:
+            raise ValueError(f"hour_from and hour_to must satisfy 1 <= hour_from <= hour_to <= {self.hours}.")
+        return hour_from, hour_to
+
+    @staticmethod
+    def _check_fields(fields: Optional[Sequence[str]]):
+        unknown = [f for f in fields or () if f not in FORECAST_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Expected a subset of {FORECAST_FIELDS}.")
+
+    def select(self, stations: Optional[Sequence[str]] = None, hour_from: int = 1, hour_to: Optional[int] = None,
+               fields: Optional[Sequence[str]] = None) -> bytes:
+        """
+        JSON array of the rows for the given stations and forecast hours
+        hour_from..hour_to (1-based, inclusive), optionally keeping only fields.
+        """
+        indices = self.station_indices(stations)
+        hour_from, hour_to = self._hour_range(hour_from, hour_to)
+        self._check_fields(fields)
+        if fields:
+            hours = slice(hour_from - 1, hour_to)
+            return encode_json([{f: row[f] for f in fields} for s in indices for row in self.rows[s][hours]])
+        if hour_from == 1 and hour_to == self.hours:
+            chunks = [self.station_bytes[s] for s in indices]
+        else:
+            chunks = [b",".join(self.row_bytes[s][hour_from - 1:hour_to]) for s in indices]
+        return b"[" + b",".join(chunks) + b"]"
+
+    def columnar(self, stations: Optional[Sequence[str]] = None, hour_from: int = 1, hour_to: Optional[int] = None,
+                 fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        The same selection as select(), as station and hour labels plus
+        (stations, hours) arrays; fields picks which of aqi/pm2_5 to include.
+        """
+        indices = self.station_indices(stations)
+        hour_from, hour_to = self._hour_range(hour_from, hour_to)
+        self._check_fields(fields)
+        hours = slice(hour_from - 1, hour_to)
+        columns: Dict[str, Any] = {
+            "stations": [self.stations[s] for s in indices],
+            "hours": list(self.hour_labels[hours]),
+        }
+        for variable in COLUMNAR_VARIABLES:
+            if not fields or variable in fields:
+                columns[variable] = getattr(self, variable)[indices, hours].tolist()
+        return columns
@@ -1,6 +1,10 @@
 import os
 from google.cloud import storage
 
+from util.logging_util import get_logger
+
+logger = get_logger("google_cloud")
+
 def download_blob_to_file(bucket_name: str, source_blob_name: str, destination_file_name: str):
     """Downloads a blob from the bucket to a local file."""
     try:
@@ -11,8 +15,8 @@ def download_blob_to_file(bucket_name: str, source_blob_name: str, destination_f
         # Download the blob to the specified local file path
         blob.download_to_filename(destination_file_name)
 
-        print(f"Blob {source_blob_name} downloaded to {destination_file_name}.")
+        logger.info("Blob downloaded", extra={"blob": source_blob_name, "destination": destination_file_name})
         return True
     except Exception as e:
-        print(f"Error downloading {source_blob_name}: {e}")
+        logger.warning("Blob download failed", extra={"blob": source_blob_name, "error": str(e)})
         return False
\ No newline at end of file
@@ -0,0 +1,144 @@
+import io
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from lib.images_to_patches import images_to_tile_patches
+from lib.prediction import (
+    FSP_PATCH_SIZE,
+    IMAGES_PATH,
+    ar_to_aqhi,
+    load_images,
+    prepare_inputs_from_patches,
+    run_inference,
+)
+from util.metrics_util import observe_stage
+
+GRID_VARIABLES = ("aqhi", "pm2_5")
+# Colour ranges for PNG tiles: AQHI bands 1-10, PM2.5 in ug/m3
+PNG_RANGES = {"aqhi": (1.0, 10.0), "pm2_5": (0.0, 75.0)}
+PNG_COLOR_STOPS = np.array([[0, 153, 0], [255, 204, 0], [204, 0, 0]], dtype=np.float32)
+
+
+@dataclass(frozen=True)
+class GridForecast:
+    """
+    Hourly forecast rasters over grid rows [r0, r1) x cols [c0, c1).
+    aqhi and pm2_5 are float16 arrays shaped (hours, rows, cols); row 0 is the
+    southern edge of the bounding box (lat_idx grows northwards).
+    """
+    aqhi: np.ndarray
+    pm2_5: np.ndarray
+    bbox: tuple[int, int, int, int]  # (r0, r1, c0, c1)
+    start_hour: int = 1
+
+    def crop(self, bbox: tuple[int, int, int, int]) -> "GridForecast":
+        r0, r1, c0, c1 = bbox
+        br0, _, bc0, _ = self.bbox
+        rows, cols = slice(r0 - br0, r1 - br0), slice(c0 - bc0, c1 - bc0)
+        return GridForecast(self.aqhi[:, rows, cols], self.pm2_5[:, rows, cols], bbox, self.start_hour)
+
+    def layer(self, variable: str, hour: Optional[int] = None) -> np.ndarray:
+        # hour is the 1-based forecast step; None returns every hour
+        raster = getattr(self, variable)
+        return raster if hour is None else raster[hour - 1]
+
+    def to_npy_bytes(self, variable: str, hour: Optional[int] = None) -> bytes:
+        buffer = io.BytesIO()
+        np.save(buffer, self.layer(variable, hour))
+        return buffer.getvalue()
+
+    def to_png_bytes(self, variable: str, hour: int) -> bytes:
+        vmin, vmax = PNG_RANGES[variable]
+        # Flip so the northern rows are at the top of the image
+        return encode_png(colorize(self.layer(variable, hour)[::-1], vmin, vmax))
+
+
+def colorize(values: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+    """
+    Maps a 2-D array onto the green-yellow-red PNG_COLOR_STOPS ramp as (H, W, 4)
+    uint8 RGBA; NaN cells are transparent.
+    """
+    values = values.astype(np.float32)
+    position = np.clip((values - vmin) / (vmax - vmin), 0.0, 1.0)
+    stops = np.linspace(0.0, 1.0, len(PNG_COLOR_STOPS))
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(np.nan_to_num(position), stops, PNG_COLOR_STOPS[:, channel])
+    rgba[..., 3] = np.where(np.isnan(values), 0, 255)
+    return rgba
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    # Minimal RGBA PNG writer: one IDAT chunk, filter type 0 on every scanline
+    height, width, _ = rgba.shape
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    scanlines = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, -1)], axis=1)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def full_bbox(images: np.ndarray) -> tuple[int, int, int, int]:
+    return (0, images.shape[2], 0, images.shape[3])
+
+
+def validate_bbox(bbox: tuple[int, int, int, int], grid_bbox: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+    r0, r1, c0, c1 = bbox
+    _, rows, _, cols = grid_bbox
+    if not (0 <= r0 < r1 <= rows and 0 <= c0 < c1 <= cols):
+        raise ValueError(f"Bounding box {bbox} must satisfy 0 <= r0 < r1 <= {rows} and 0 <= c0 < c1 <= {cols}.")
+    return bbox
+
+
+def forecast_grid(bundle, images: Optional[np.ndarray] = None, bbox: Optional[tuple[int, int, int, int]] = None, tile_size: int = 8) -> GridForecast:
+    """
+    Predicts AQHI and PM2.5 at every grid cell of bbox (default: the whole grid).
+
+    Cells are processed in tile_size x tile_size tiles: each tile's patches are
+    cut from one bordered block with sliding-window views and both models run
+    on the tile as a batch, so peak memory is bounded by the tile, not the grid.
+    The PM2.5 model's station embedding is that of the nearest station cell.
+    """
+    with observe_stage("grid_forecast"):
+        return _forecast_grid(bundle, images, bbox, tile_size)
+
+
+def _forecast_grid(bundle, images, bbox, tile_size) -> GridForecast:
+    images = load_images(IMAGES_PATH) if images is None else images
+    r0, r1, c0, c1 = validate_bbox(bbox or full_bbox(images), full_bbox(images))
+    station_tree = cKDTree(bundle.station_cells)
+    aqhi = pm2_5 = None
+
+    for tr in range(r0, r1, tile_size):
+        for tc in range(c0, c1, tile_size):
+            rows, cols = (tr, min(tr + tile_size, r1)), (tc, min(tc + tile_size, c1))
+            patches = images_to_tile_patches(images, rows, cols, FSP_PATCH_SIZE)  # (T, C, cells, 15, 15)
+            X_aqi, X_fsp = prepare_inputs_from_patches(patches, bundle.aqi_scalers, bundle.fsp_scaler)
+            del patches
+
+            cells = np.stack(np.meshgrid(np.arange(*rows), np.arange(*cols), indexing="ij"), axis=-1).reshape(-1, 2)
+            _, nearest_station = station_tree.query(cells)
+            # Same runners (INFERENCE_BACKEND) and batch/thread settings as the station forecast
+            ar, fsp = run_inference(bundle.aqi_runner, bundle.fsp_runner, X_aqi, X_fsp, bundle.device, station_idx=nearest_station)  # (cells, hours)
+
+            if aqhi is None:
+                hours = ar.shape[1]
+                aqhi = np.empty((hours, r1 - r0, c1 - c0), dtype=np.float16)
+                pm2_5 = np.empty((hours, r1 - r0, c1 - c0), dtype=np.float16)
+            shape = (rows[1] - rows[0], cols[1] - cols[0], -1)
+            window = (slice(None), slice(rows[0] - r0, rows[1] - r0), slice(cols[0] - c0, cols[1] - c0))
+            aqhi[window] = ar_to_aqhi(ar).reshape(shape).transpose(2, 0, 1)
+            pm2_5[window] = fsp.reshape(shape).transpose(2, 0, 1)
+
+    return GridForecast(aqhi=aqhi, pm2_5=pm2_5, bbox=(r0, r1, c0, c1))
@@ -2,27 +2,57 @@ import numpy as np
 import pandas as pd
 
 
-def images_to_patches(images: str | np.ndarray, stations_filepath, patch_size=15):
-    if isinstance(images, str):
-        images = np.load(images)
-    images = images.astype(np.float32)
-
+def load_station_cells(stations_filepath: str) -> np.ndarray:
     stations = pd.read_csv(stations_filepath).drop(columns=["Longitude", "Latitude"])
-    station_cells = stations[["lat_idx", "lon_idx"]].to_numpy()
-
-    pad = patch_size // 2
-    images_padded = np.pad(images, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode="edge")
+    return stations[["lat_idx", "lon_idx"]].to_numpy()
 
-    windows = np.lib.stride_tricks.sliding_window_view(
-        x=images_padded, window_shape=(patch_size, patch_size), axis=(2, 3)
-    )
-    i_idx = station_cells[:, 0]
-    j_idx = station_cells[:, 1]
 
-    all_patches = windows[:, :, i_idx, j_idx, :, :]
+def images_to_patches(images: str | np.ndarray, stations: str | np.ndarray, patch_size=15, channels=None):
+    if isinstance(images, str):
+        images = np.load(images, mmap_mode="r")
 
-    return all_patches
+    # Accept either the station CSV path or pre-loaded (lat_idx, lon_idx) cells
+    station_cells = load_station_cells(stations) if isinstance(stations, str) else stations
 
+    # Clamped indices reproduce np.pad(mode="edge") without padding the whole grid,
+    # so only the station patches are ever read (or paged in from a memory map)
+    _, C, H, W = images.shape
+    pad = patch_size // 2
+    offsets = np.arange(-pad, pad + 1)
+    rows = np.clip(station_cells[:, 0, np.newaxis] + offsets, 0, H - 1)  # (S, P)
+    cols = np.clip(station_cells[:, 1, np.newaxis] + offsets, 0, W - 1)  # (S, P)
+    channels = np.arange(C) if channels is None else np.asarray(channels)
+
+    all_patches = images[
+        :,
+        channels[:, np.newaxis, np.newaxis, np.newaxis],
+        rows[np.newaxis, :, :, np.newaxis],
+        cols[np.newaxis, :, np.newaxis, :],
+    ]  # (T, C, S, P, P)
+
+    # Advanced indexing leaves a transposed memory layout; callers expect C order
+    return np.ascontiguousarray(all_patches, dtype=np.float32)
+
+def images_to_tile_patches(images: np.ndarray, row_range: tuple[int, int], col_range: tuple[int, int], patch_size=15, channels=None):
+    """
+    Patches centred on every cell of the rectangle rows [r0, r1) x cols [c0, c1),
+    returned as (T, C, cells, P, P) with cells in row-major order.
+
+    Only the rectangle plus a patch_size // 2 border (edge-clamped like
+    images_to_patches) is read; the per-cell patches are sliding-window views
+    into that block, so memory scales with the tile rather than the grid.
+    """
+    _, C, H, W = images.shape
+    pad = patch_size // 2
+    (r0, r1), (c0, c1) = row_range, col_range
+    rows = np.clip(np.arange(r0 - pad, r1 + pad), 0, H - 1)
+    cols = np.clip(np.arange(c0 - pad, c1 + pad), 0, W - 1)
+    channels = np.arange(C) if channels is None else np.asarray(channels)
+
+    block = images[:, channels[:, np.newaxis, np.newaxis], rows[np.newaxis, :, np.newaxis], cols[np.newaxis, np.newaxis, :]]
+    windows = np.lib.stride_tricks.sliding_window_view(block, (patch_size, patch_size), axis=(2, 3))  # (T, C, R, W, P, P)
+    T = windows.shape[0]
+    return np.ascontiguousarray(windows.reshape(T, len(channels), -1, patch_size, patch_size), dtype=np.float32)
 
 if __name__ == "__main__":
     images_path = "./images_filled_griddata_idw_correct_date_aqi_weekend.npy"
@@ -0,0 +1,159 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, Optional
+
+import torch
+
+from util.logging_util import get_logger
+
+logger = get_logger("inference_settings")
+
+INFERENCE_SETTINGS_PATH = os.getenv("INFERENCE_SETTINGS_PATH", "./lib/inference_settings.json")
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else None
+
+
+def _default_intra_op_threads() -> int:
+    # Split the host's cores between the gunicorn workers (gunicorn reads WEB_CONCURRENCY too)
+    workers = _env_int("WEB_CONCURRENCY") or 1
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+@dataclass(frozen=True)
+class InferenceSettings:
+    """
+    Per-worker CPU inference settings.
+
+    batch_size is the number of stations (or grid cells) per forward pass;
+    0 runs them all in one batch (17 stations x 48 frames = 816 CNN images).
+    """
+    batch_size: int = 0
+    intra_op_threads: int = 1
+    inter_op_threads: int = 1
+    inference_mode: bool = True
+
+    @classmethod
+    def from_env(cls, path: str = INFERENCE_SETTINGS_PATH) -> "InferenceSettings":
+        """
+        Defaults, overridden by a saved auto-tune result at path, overridden by
+        INFERENCE_BATCH_SIZE / INFERENCE_INTRA_OP_THREADS / INFERENCE_INTER_OP_THREADS
+        / INFERENCE_MODE.
+        """
+        settings = cls(intra_op_threads=_default_intra_op_threads())
+        tuned = load_tuned_settings(path)
+        if tuned is not None:
+            settings = tuned
+        overrides = {
+            "batch_size": _env_int("INFERENCE_BATCH_SIZE"),
+            "intra_op_threads": _env_int("INFERENCE_INTRA_OP_THREADS"),
+            "inter_op_threads": _env_int("INFERENCE_INTER_OP_THREADS"),
+        }
+        if os.getenv("INFERENCE_MODE"):
+            overrides["inference_mode"] = os.getenv("INFERENCE_MODE").lower() == "true"
+        return replace(settings, **{k: v for k, v in overrides.items() if v is not None})
+
+
+def load_tuned_settings(path: str = INFERENCE_SETTINGS_PATH) -> Optional[InferenceSettings]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+        return InferenceSettings(**saved["settings"])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Ignoring unreadable tuning file", extra={"path": path, "error": str(e)})
+        return None
+
+
+_current = InferenceSettings.from_env()
+
+
+def current_settings() -> InferenceSettings:
+    return _current
+
+
+def apply_settings(settings: InferenceSettings) -> InferenceSettings:
+    """
+    Makes settings current and applies the torch thread counts for this process.
+    """
+    global _current
+    torch.set_num_threads(settings.intra_op_threads)
+    try:
+        torch.set_num_interop_threads(settings.inter_op_threads)
+    except RuntimeError:
+        # Only settable before the first inter-op parallel work in the process
+        if torch.get_num_interop_threads() != settings.inter_op_threads:
+            logger.info("Inter-op threads already started, keeping them", extra={"inter_op_threads": torch.get_num_interop_threads()})
+    _current = settings
+    return settings
+
+
+def inference_context(settings: Optional[InferenceSettings] = None):
+    settings = settings or _current
+    return torch.inference_mode() if settings.inference_mode else torch.no_grad()
+
+
+def batch_slices(n: int, batch_size: int):
+    # Slices covering range(n) in micro-batches; batch_size <= 0 means one batch
+    step = n if batch_size <= 0 else batch_size
+    return [slice(i, min(i + step, n)) for i in range(0, n, max(step, 1))]
+
+
+def autotune(bundle, images, repeats: int = 3, path: Optional[str] = INFERENCE_SETTINGS_PATH) -> Dict[str, Any]:
+    """
+    Times the station forecast under a few batch size / thread count
+    combinations on this host and saves the fastest as the tuned settings.
+    """
+    from lib.prediction import prepare_inputs, run_inference
+
+    X_aqi, X_fsp = prepare_inputs(images, bundle.aqi_scalers, bundle.fsp_scaler, bundle.station_cells)
+    base = _current
+    max_threads = _default_intra_op_threads()
+    thread_options = sorted({1, max(1, max_threads // 2), max_threads})
+    batch_options = (0, 4, 8)
+
+    results = []
+    try:
+        for batch_size, threads in itertools.product(batch_options, thread_options):
+            settings = apply_settings(replace(base, batch_size=batch_size, intra_op_threads=threads))
+            run_inference(bundle.aqi_runner, bundle.fsp_runner, X_aqi, X_fsp, bundle.device, settings)  # Warm-up
+            start = time.perf_counter()
+            for _ in range(repeats):
+                run_inference(bundle.aqi_runner, bundle.fsp_runner, X_aqi, X_fsp, bundle.device, settings)
+            results.append({"settings": asdict(settings), "seconds": (time.perf_counter() - start) / repeats})
+    finally:
+        apply_settings(base)
+
+    best = min(results, key=lambda r: r["seconds"])
+    report = {
+        "settings": best["settings"],
+        "seconds": round(best["seconds"], 4),
+        "cpu_count": os.cpu_count(),
+        "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": [{**r, "seconds": round(r["seconds"], 4)} for r in results],
+    }
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CPU inference settings on this host and save the fastest")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=INFERENCE_SETTINGS_PATH, help="where to save the tuned settings")
+    args = parser.parse_args()
+
+    from lib.model_registry import model_registry
+    from lib.prediction import IMAGES_PATH, load_images
+
+    report = autotune(model_registry.get(), load_images(IMAGES_PATH), repeats=args.repeats, path=args.output)
+    print(json.dumps(report, indent=2))
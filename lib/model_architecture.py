@@ -63,6 +63,13 @@ class AQI_CNNLSTM(nn.Module):
         x = x.view(batch_size * self.seq_length, channels, height, width)
         cnn_out = self.cnn(x)  # (batch_size * seq_length, 64)
         lstm_in = cnn_out.view(batch_size, self.seq_length, -1)  # (batch_size, seq_length, 64)
+        return self.forward_embeddings(lstm_in)
+
+    def forward_embeddings(self, lstm_in):
+        """
+        lstm_in: (batch_size, seq_length, 64) per-frame CNN embeddings
+        Lets callers cache self.cnn outputs for frames that have not changed.
+        """
         lstm_out, _ = self.lstm(lstm_in)  # (batch_size, seq_length, lstm_hidden_size)
         last_time_step_out = lstm_out[:, -1, :]
         prediction = self.fc(last_time_step_out)
@@ -151,6 +158,14 @@ class FSP_CNNLSTM(nn.Module):
         x = patch_seq.reshape(B * T, C, H, W)
         z = self.encoder(x)  # (B*T, cnn_embed)
         z = z.view(B, T, -1)  # (B, T, cnn_embed)
+        return self.forward_embeddings(z, station_idx)
+
+    def forward_embeddings(self, z, station_idx):
+        """
+        z: (B, seq_len, cnn_embed) per-frame encoder outputs
+        station_idx: (B,)
+        """
+        T = z.shape[1]
 
         # station embedding
         emb = self.station_emb(station_idx)  # (B, embed_dim)
@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from lib.export_model import build_backend, parity_error
+from lib.images_to_patches import load_station_cells
+from lib.prediction import (
+    CompiledScaler,
+    AQI_MODEL_PATH,
+    AQI_SCALERS_PATH,
+    FSP_MODEL_PATH,
+    FSP_SCALERS_PATH,
+    STATIONS_CSV,
+    compile_channel_scalers,
+    compile_patch_scaler,
+    load_model,
+    load_scalers,
+    load_station_names,
+    state_dict_nbytes,
+)
+from util.logging_util import get_logger
+
+logger = get_logger("model_registry")
+
+# Fall back to eager models when an optimized backend drifts more than this (absolute)
+BACKEND_PARITY_TOLERANCE = 1e-3
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """Everything forecast_aq() needs besides the input tensor, loaded together."""
+
+    aqi_model: nn.Module  # Eager models (used directly by the rolling forecaster)
+    fsp_model: nn.Module
+    aqi_runner: Any  # Same models in the selected inference backend
+    fsp_runner: Any
+    aqi_scalers: CompiledScaler
+    fsp_scaler: CompiledScaler
+    station_names: list[str]
+    station_cells: np.ndarray
+    device: torch.device
+    file_versions: Dict[str, int] = field(default_factory=dict)  # {path: mtime_ns}
+    loaded_at: float = 0.0
+    load_seconds: float = 0.0
+    memory_bytes: int = 0
+    backend: str = "eager"
+    backend_parity_error: float = 0.0
+
+
+def _scaler_nbytes(scaler: CompiledScaler) -> int:
+    return scaler.scale.nbytes + scaler.offset.nbytes
+
+
+class ModelRegistry:
+    """
+    Owns the forecast models, scalers and station index for the process lifetime.
+
+    Artefacts are loaded lazily on the first get() (or eagerly via load()) and
+    reloaded when any of the source files changes on disk. A reload builds a
+    complete new ModelBundle before swapping it in, so callers holding the
+    previous bundle keep a consistent set until they finish.
+    """
+
+    def __init__(
+        self,
+        aqi_model_path: str = AQI_MODEL_PATH,
+        fsp_model_path: str = FSP_MODEL_PATH,
+        aqi_scalers_path: str = AQI_SCALERS_PATH,
+        fsp_scalers_path: str = FSP_SCALERS_PATH,
+        stations_csv: str = STATIONS_CSV,
+        device: Optional[torch.device] = None,
+        backend: Optional[str] = None,
+        quantize: Optional[bool] = None,
+    ):
+        self.aqi_model_path = aqi_model_path
+        self.fsp_model_path = fsp_model_path
+        self.aqi_scalers_path = aqi_scalers_path
+        self.fsp_scalers_path = fsp_scalers_path
+        self.stations_csv = stations_csv
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.backend = (backend or os.getenv("INFERENCE_BACKEND", "eager")).lower()
+        self.quantize = os.getenv("INFERENCE_QUANTIZE", "false").lower() == "true" if quantize is None else quantize
+        self._bundle: Optional[ModelBundle] = None
+        self._lock = threading.Lock()
+        self._reload_count = 0
+        self._failed_versions: Optional[Dict[str, int]] = None
+
+    def _paths(self) -> list[str]:
+        return [
+            self.aqi_model_path,
+            self.fsp_model_path,
+            self.aqi_scalers_path,
+            self.fsp_scalers_path,
+            self.stations_csv,
+        ]
+
+    def _file_versions(self) -> Dict[str, int]:
+        return {path: os.stat(path).st_mtime_ns for path in self._paths()}
+
+    def _build_runners(self, aqi_model: nn.Module, fsp_model: nn.Module) -> tuple[Any, Any, str, float]:
+        if self.backend == "eager":
+            return aqi_model, fsp_model, "eager", 0.0
+        try:
+            aqi_runner = build_backend(aqi_model, "aqi", self.backend, self.device)
+            fsp_runner = build_backend(fsp_model, "fsp", self.backend, self.device)
+            error = max(
+                parity_error(aqi_model, aqi_runner, "aqi", self.device),
+                parity_error(fsp_model, fsp_runner, "fsp", self.device),
+            )
+        except Exception as e:
+            logger.warning("Inference backend unavailable, using eager models", extra={"backend": self.backend, "error": str(e)})
+            return aqi_model, fsp_model, "eager", 0.0
+        if error > BACKEND_PARITY_TOLERANCE:
+            logger.warning("Inference backend differs from eager, using eager models", extra={"backend": self.backend, "parity_error": f"{error:.2e}"})
+            return aqi_model, fsp_model, "eager", error
+        return aqi_runner, fsp_runner, self.backend, error
+
+    def _build(self) -> ModelBundle:
+        start = time.perf_counter()
+        versions = self._file_versions()
+        aqi_model, fsp_model = load_model(self.aqi_model_path, self.fsp_model_path, self.device, quantize=self.quantize)
+        aqi_runner, fsp_runner, backend, backend_error = self._build_runners(aqi_model, fsp_model)
+        # Scalers are compiled to plain numpy arrays (sklearn parity: tests/test_scalers.py); sklearn stays off the request path
+        aqi_scalers = compile_channel_scalers(load_scalers(self.aqi_scalers_path))
+        fsp_scaler = compile_patch_scaler(load_scalers(self.fsp_scalers_path))
+        station_names = load_station_names(self.stations_csv)
+        station_cells = load_station_cells(self.stations_csv)
+        memory_bytes = (
+            state_dict_nbytes(aqi_model)
+            + state_dict_nbytes(fsp_model)
+            + _scaler_nbytes(aqi_scalers)
+            + _scaler_nbytes(fsp_scaler)
+            + station_cells.nbytes
+        )
+        return ModelBundle(
+            aqi_model=aqi_model,
+            fsp_model=fsp_model,
+            aqi_runner=aqi_runner,
+            fsp_runner=fsp_runner,
+            aqi_scalers=aqi_scalers,
+            fsp_scaler=fsp_scaler,
+            station_names=station_names,
+            station_cells=station_cells,
+            device=self.device,
+            file_versions=versions,
+            loaded_at=time.time(),
+            load_seconds=time.perf_counter() - start,
+            memory_bytes=memory_bytes,
+            backend=backend,
+            backend_parity_error=backend_error,
+        )
+
+    def _is_stale(self, bundle: ModelBundle) -> bool:
+        try:
+            versions = self._file_versions()
+        except OSError:
+            # A file is mid-replacement; keep serving the bundle we have
+            return False
+        # Don't retry a reload that already failed for these exact files
+        return versions != bundle.file_versions and versions != self._failed_versions
+
+    def _swap_in(self, bundle: ModelBundle) -> ModelBundle:
+        if self._bundle is not None:
+            self._reload_count += 1
+        self._bundle = bundle
+        logger.info("Loaded models", extra={"seconds": round(bundle.load_seconds, 3), "memory_mb": round(bundle.memory_bytes / 1e6, 1)})
+        return bundle
+
+    def load(self) -> ModelBundle:
+        """
+        Loads (or reloads) every artefact and atomically swaps in the new bundle.
+        """
+        with self._lock:
+            return self._swap_in(self._build())
+
+    def get(self) -> ModelBundle:
+        """
+        Returns the resident bundle, loading it on first use and reloading it
+        when a weight, scaler or station file has changed on disk.
+        """
+        bundle = self._bundle
+        if bundle is not None and not self._is_stale(bundle):
+            return bundle
+        with self._lock:
+            # Another caller may have finished the (re)load while we waited
+            current = self._bundle
+            if current is not None and not self._is_stale(current):
+                return current
+            try:
+                return self._swap_in(self._build())
+            except Exception:
+                if current is None:
+                    raise
+                try:
+                    self._failed_versions = self._file_versions()
+                except OSError:
+                    pass
+                logger.exception("Reload failed, keeping previous models")
+                return current
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns load time, memory footprint and file versions of the resident bundle.
+        """
+        bundle = self._bundle
+        if bundle is None:
+            return {"loaded": False}
+        return {
+            "loaded": True,
+            "device": str(bundle.device),
+            "backend": bundle.backend,
+            "quantized": self.quantize,
+            "backend_parity_error": bundle.backend_parity_error,
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(bundle.loaded_at)),
+            "load_seconds": round(bundle.load_seconds, 4),
+            "memory_bytes": bundle.memory_bytes,
+            "reload_count": self._reload_count,
+            "file_versions": bundle.file_versions,
+        }
+
+
+model_registry = ModelRegistry()
@@ -3,18 +3,65 @@ import pickle
 import pandas as pd
 import torch
 import torch.nn as nn
+import io
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
 
-from lib.images_to_patches import images_to_patches
+from lib.images_to_patches import images_to_patches, load_station_cells
+from lib.inference_settings import InferenceSettings, batch_slices, current_settings, inference_context
 from lib.model_architecture import AQI_CNNLSTM, FSP_CNNLSTM
+from util.metrics_util import observe_stage
 
 
+IMAGES_PATH = "./lib/past48h_tensor.npy"
+AQI_SCALERS_PATH = "./lib/x_scalers_aqi.pkl"
+FSP_SCALERS_PATH = "./lib/x_scalers_fsp.pkl"
+STATIONS_CSV = "./lib/stations_epd_idx.csv"
+AQI_MODEL_PATH = "./lib/cnn_lstm_aqi.pth"
+FSP_MODEL_PATH = "./lib/cnn_lstm_fsp.pth"
+
+AQI_PATCH_SIZE = 3
+FSP_PATCH_SIZE = 15
+AQI_CHANNEL = 6  # Only the AQI model sees this channel
+
+# Runs predict_aqi and predict_fsp side by side; torch releases the GIL during ops
+_model_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="forecast-model")
+
 # Thresholds for converting added health risk to AQHI bands
 AQHI_THRESHOLDS = np.array([1.87, 3.73, 5.60, 7.46, 9.33, 11.20, 12.81, 14.94, 17.08, 19.21])
 
 
-def load_images(path: str) -> np.ndarray:
-    return np.load(path)
+def load_images(path: str, mmap_mode: str | None = "r") -> np.ndarray:
+    # Memory-mapped by default: patch extraction only pages in the station cells
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+def tensor_end_time(path: str = IMAGES_PATH) -> datetime:
+    """
+    The time the daily 48h tensor at path ends: midnight of the day it was
+    downloaded (its modification date), so an older tensor kept after a
+    failed download is recognised as such.
+    """
+    return datetime.fromtimestamp(os.path.getmtime(path)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ensure_float32_tensor(path: str):
+    """
+    Rewrites an image tensor file as float32 so later loads need no dtype conversion.
+    """
+    images = np.load(path, mmap_mode="r")
+    if images.dtype == np.float32:
+        return
+    tmp_path = f"{path}.tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=images.shape)
+    for t in range(images.shape[0]):  # One frame at a time keeps the conversion's footprint small
+        out[t] = images[t]
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
 
 
 def load_scalers(path: str):
@@ -42,31 +89,106 @@ def transform_with_scalers(X: np.ndarray, scaler) -> np.ndarray:
     return scaled.reshape(X.shape[0], X.shape[2], 15, 15, 15).transpose(0, 2, 1, 3, 4)
 
 
+@dataclass(frozen=True)
+class CompiledScaler:
+    """
+    A fitted sklearn scaler reduced to x * scale + offset, with arrays shaped
+    to broadcast over (T, C, S, H, W) patches.
+    """
+    scale: np.ndarray
+    offset: np.ndarray
+
+
+def _affine_params(sc) -> tuple[np.ndarray, np.ndarray]:
+    # StandardScaler: (x - mean) / std; MinMaxScaler: x * scale + min
+    if hasattr(sc, "mean_") or hasattr(sc, "with_std"):
+        n = sc.n_features_in_
+        mul = 1.0 / sc.scale_ if getattr(sc, "with_std", True) and sc.scale_ is not None else np.ones(n)
+        mean = sc.mean_ if getattr(sc, "with_mean", True) and sc.mean_ is not None else np.zeros(n)
+        return mul, -mean * mul
+    if hasattr(sc, "min_") and hasattr(sc, "scale_"):
+        return np.asarray(sc.scale_, dtype=np.float64), np.asarray(sc.min_, dtype=np.float64)
+    raise TypeError(f"Unsupported scaler type for compilation: {type(sc).__name__}")
+
+
+def compile_channel_scalers(scalers) -> CompiledScaler:
+    # One single-feature scaler per channel -> (1, C, 1, 1, 1)
+    params = [_affine_params(sc) for sc in scalers]
+    mul = np.array([p[0][0] for p in params], dtype=np.float64)
+    add = np.array([p[1][0] for p in params], dtype=np.float64)
+    shape = (1, len(scalers), 1, 1, 1)
+    return CompiledScaler(mul.reshape(shape).astype(np.float32), add.reshape(shape).astype(np.float32))
+
+
+def compile_patch_scaler(scaler, channels: int = 15, patch_size: int = 15) -> CompiledScaler:
+    # One scaler over flattened (C, H, W) patches -> (1, C, 1, H, W)
+    mul, add = _affine_params(scaler)
+    shape = (1, channels, 1, patch_size, patch_size)
+    return CompiledScaler(
+        mul.reshape(channels, patch_size, patch_size).reshape(shape).astype(np.float32),
+        add.reshape(channels, patch_size, patch_size).reshape(shape).astype(np.float32),
+    )
+
+
+def apply_compiled_scaler(X: np.ndarray, compiled: CompiledScaler, out: np.ndarray | None = None) -> np.ndarray:
+    # Broadcast multiply-add, in place when out is X
+    out = np.multiply(X, compiled.scale, out=out)
+    out += compiled.offset
+    return out
+
+
+def scaler_parity_error(reference: np.ndarray, compiled_output: np.ndarray) -> float:
+    # Largest absolute difference relative to the sklearn output's magnitude
+    return float(np.max(np.abs(reference - compiled_output)) / max(1.0, float(np.max(np.abs(reference)))))
+
+
 def ar_to_aqhi(ar: np.ndarray) -> np.ndarray:
     # Convert %AR to AQHI index (1-10)
     bin_index = np.sum(ar[..., np.newaxis] > AQHI_THRESHOLDS, axis=-1) + 1
     return np.where(bin_index <= 10, bin_index, 10)
 
 
-def prepare_input_aqi(images: np.ndarray, scalers_path: str, stations_csv: str, patch_size: int) -> np.ndarray:
-    patches = images_to_patches(images, stations_csv, patch_size)
-    scalers = load_scalers(scalers_path)
-    scaled = transform_with_channel_scalers(patches, scalers)
+def prepare_inputs(images: np.ndarray, aqi_scalers, fsp_scaler, stations) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Builds both model inputs from a single patch extraction: 15x15 patches are
+    gathered once and the AQI model's 3x3 patches are their centre (a view).
+    Returns (X_aqi, X_fsp), each shaped (stations, seq, channels, H, W).
+    """
+    patches = images_to_patches(images, stations, FSP_PATCH_SIZE)  # (T, C, S, 15, 15)
+    return prepare_inputs_from_patches(patches, aqi_scalers, fsp_scaler)
+
+
+def prepare_inputs_from_patches(patches: np.ndarray, aqi_scalers, fsp_scaler) -> tuple[np.ndarray, np.ndarray]:
+    # patches: (T, C, S, 15, 15) gathered with every channel (see images_to_patches)
+    lo = FSP_PATCH_SIZE // 2 - AQI_PATCH_SIZE // 2
+    aqi_patches = patches[..., lo : lo + AQI_PATCH_SIZE, lo : lo + AQI_PATCH_SIZE]
+    fsp_patches = patches[:, np.delete(np.arange(patches.shape[1]), AQI_CHANNEL)]  # Fancy index: a fresh copy
+
+    if isinstance(aqi_scalers, CompiledScaler):
+        X_aqi = apply_compiled_scaler(aqi_patches, aqi_scalers)  # Writes a new array; patches stay intact
+    else:
+        X_aqi = transform_with_channel_scalers(np.ascontiguousarray(aqi_patches), aqi_scalers)
+    if isinstance(fsp_scaler, CompiledScaler):
+        X_fsp = apply_compiled_scaler(fsp_patches, fsp_scaler, out=fsp_patches)
+    else:
+        X_fsp = transform_with_scalers(fsp_patches, fsp_scaler)
     # Reorder to (batch=stations, seq, channels, H, W)
-    return scaled.transpose(2, 0, 1, 3, 4)
+    return X_aqi.transpose(2, 0, 1, 3, 4), X_fsp.transpose(2, 0, 1, 3, 4)
 
 
-def prepare_input_fsp(images: np.ndarray, scalers_path: str, stations_csv: str, patch_size: int) -> np.ndarray:
-    # Remove the AQI channel
-    images = np.delete(images, 6, axis=1)
-    patches = images_to_patches(images, stations_csv, patch_size)
-    scalers = load_scalers(scalers_path)
-    scaled = transform_with_scalers(patches, scalers)
-    # Reorder to (batch=stations, seq, channels, H, W)
-    return scaled.transpose(2, 0, 1, 3, 4)
+def quantize_model(model: nn.Module) -> nn.Module:
+    # Dynamic int8: weights stored as int8, activations quantized on the fly (CPU only)
+    return torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
 
+def state_dict_nbytes(model: nn.Module) -> int:
+    # Serialized state size, which also counts int8 packed weights of quantized layers
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
 
-def load_model(aqi_path: str, pm_path, device) -> nn.Module:
+
+def load_model(aqi_path: str, pm_path, device, quantize: bool = False) -> nn.Module:
     aqi_model = AQI_CNNLSTM(
         in_channels=16,
         num_residual_units=4,
@@ -87,57 +209,98 @@ def load_model(aqi_path: str, pm_path, device) -> nn.Module:
     aqi_model.eval()
     fsp_model.load_state_dict(torch.load(pm_path, map_location=device))
     fsp_model.eval()
+    if quantize:
+        if device.type != "cpu":
+            raise ValueError("Dynamic int8 quantization is only supported on CPU.")
+        aqi_model, fsp_model = quantize_model(aqi_model), quantize_model(fsp_model)
     return aqi_model, fsp_model
 
 
-def predict_aqi(model: nn.Module, X_s: np.ndarray, device) -> np.ndarray:
-    with torch.no_grad():
-        inp = torch.tensor(X_s).to(device)
-        ar = model(inp).cpu().numpy()
+def predict_aqi(model: nn.Module, X_s: np.ndarray, device, settings: InferenceSettings | None = None) -> np.ndarray:
+    settings = settings or current_settings()
+    with observe_stage("predict_aqi"), inference_context(settings):
+        inp = torch.from_numpy(np.ascontiguousarray(X_s)).to(device)
+        # Micro-batches of stations bound the CNN batch (stations x 48 frames)
+        ar = np.concatenate([model(inp[b]).cpu().numpy() for b in batch_slices(len(inp), settings.batch_size)])
     return ar
 
 
-def predict_fsp(model: nn.Module, X_s: np.ndarray, device) -> np.ndarray:
-    with torch.no_grad():
-        inp = torch.tensor(X_s).to(device)
-        station_idx = torch.tensor(list(range(17))).to(device)
-        ar = model(inp, station_idx).cpu().numpy()
+def predict_fsp(model: nn.Module, X_s: np.ndarray, device, station_idx: np.ndarray | None = None, settings: InferenceSettings | None = None) -> np.ndarray:
+    # station_idx selects the station embedding per row; defaults to the 17 stations in order
+    settings = settings or current_settings()
+    with observe_stage("predict_fsp"), inference_context(settings):
+        inp = torch.from_numpy(np.ascontiguousarray(X_s)).to(device)
+        if station_idx is None:
+            station_idx = np.arange(17)
+        station_idx = torch.as_tensor(station_idx, dtype=torch.long).to(device)
+        ar = np.concatenate([model(inp[b], station_idx[b]).cpu().numpy() for b in batch_slices(len(inp), settings.batch_size)])
     return ar
 
 
-def format_output(aqhi: np.ndarray, fsp: np.ndarray, station_names: list[str], start_hour: int = 1) -> list[dict]:
-    hours = aqhi.shape[1]
-    times = [f"{h:02d}:00" for h in range(start_hour, start_hour + hours)]
-    output = []
-    for si, station in enumerate(station_names[: aqhi.shape[0]]):
-        for hi, t in enumerate(times):
-            output.append(
-                {"date": None, "time": t, "station": station, "aqi": int(aqhi[si, hi]), "pm2_5": (int(fsp[si, hi]))}
-            )
-    return output
+def run_inference(aqi_model: nn.Module, fsp_model: nn.Module, X_aqi: np.ndarray, X_fsp: np.ndarray, device, settings: InferenceSettings | None = None,
+                  station_idx: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    # Both models run concurrently; returns (ar, fsp)
+    fsp_future = _model_pool.submit(predict_fsp, fsp_model, X_fsp, device, station_idx, settings)
+    ar = predict_aqi(aqi_model, X_aqi, device, settings)
+    return ar, fsp_future.result()
 
 
-def forecast_aq():
-    images_path = "./lib/past48h_tensor.npy"
-    aqi_scalers_path = "./lib/x_scalers_aqi.pkl"
-    fsp_scalers_path = "./lib/x_scalers_fsp.pkl"
-    stations_csv = "./lib/stations_epd_idx.csv"
-    aqi_model_path = "./lib/cnn_lstm_aqi.pth"
-    fsp_model_path = "./lib/cnn_lstm_fsp.pth"
-
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    images = load_images(images_path)
-    X_s_aqi = prepare_input_aqi(images, aqi_scalers_path, stations_csv, 3)
-    X_s_fsp = prepare_input_fsp(images, fsp_scalers_path, stations_csv, 15)
-    aqi_model, fsp_model = load_model(aqi_model_path, fsp_model_path, device)
-    ar = predict_aqi(aqi_model, X_s_aqi, device)
-    fsp = predict_fsp(fsp_model, X_s_fsp, device)
-    aqhi = ar_to_aqhi(ar)
-    station_names = load_station_names(stations_csv)
-    output = format_output(aqhi, fsp, station_names)
-    return output
+def format_columnar(aqhi: np.ndarray, fsp: np.ndarray, station_names: list[str], start_hour: int = 1) -> dict:
+    """
+    Columnar forecast: station and hour labels plus (stations, hours) integer
+    arrays, converted with one vectorized cast per array.
+    """
+    n_stations, hours = min(len(station_names), aqhi.shape[0]), aqhi.shape[1]
+    return {
+        "stations": list(station_names[:n_stations]),
+        # Hours are labelled 01:00..24:00, wrapping past midnight for later start hours
+        "hours": [f"{(h - 1) % 24 + 1:02d}:00" for h in range(start_hour, start_hour + hours)],
+        "aqi": aqhi[:n_stations].astype(np.int64).tolist(),
+        "pm2_5": fsp[:n_stations].astype(np.int64).tolist(),  # Truncated, as int() did
+    }
 
 
+def format_output(aqhi: np.ndarray, fsp: np.ndarray, station_names: list[str], start_hour: int = 1) -> list[dict]:
+    columns = format_columnar(aqhi, fsp, station_names, start_hour)
+    return [
+        {"date": None, "time": t, "station": station, "aqi": aqi, "pm2_5": pm2_5}
+        for station, aqi_row, pm2_5_row in zip(columns["stations"], columns["aqi"], columns["pm2_5"])
+        for t, aqi, pm2_5 in zip(columns["hours"], aqi_row, pm2_5_row)
+    ]
+
+
+def forecast_aq(bundle=None, columnar: bool = False):
+    """
+    Runs the full forecast. Pass a loaded ModelBundle (see lib.model_registry)
+    to reuse resident models, scalers and station index; without one every
+    artefact is loaded from disk for this call only. columnar=True returns
+    format_columnar arrays instead of format_output rows.
+    """
+    if bundle is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        aqi_model, fsp_model = load_model(AQI_MODEL_PATH, FSP_MODEL_PATH, device)
+        aqi_scalers = compile_channel_scalers(load_scalers(AQI_SCALERS_PATH))
+        fsp_scaler = compile_patch_scaler(load_scalers(FSP_SCALERS_PATH))
+        station_names = load_station_names(STATIONS_CSV)
+        station_cells = load_station_cells(STATIONS_CSV)
+    else:
+        device = bundle.device
+        aqi_model, fsp_model = bundle.aqi_runner, bundle.fsp_runner
+        aqi_scalers, fsp_scaler = bundle.aqi_scalers, bundle.fsp_scaler
+        station_names, station_cells = bundle.station_names, bundle.station_cells
+
+    with observe_stage("load_images"):
+        images = load_images(IMAGES_PATH)
+    with observe_stage("prepare_inputs"):
+        X_s_aqi, X_s_fsp = prepare_inputs(images, aqi_scalers, fsp_scaler, station_cells)
+    with observe_stage("run_inference"):
+        ar, fsp = run_inference(aqi_model, fsp_model, X_s_aqi, X_s_fsp, device)
+    with observe_stage("ar_to_aqhi"):
+        aqhi = ar_to_aqhi(ar)
+    with observe_stage("format_output"):
+        output = (format_columnar if columnar else format_output)(aqhi, fsp, station_names)
+    return output
+
 
 if __name__ == "__main__":
     forecast_aq()
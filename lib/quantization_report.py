@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from lib.images_to_patches import load_station_cells
+from lib.prediction import (
+    AQI_MODEL_PATH,
+    AQI_SCALERS_PATH,
+    FSP_MODEL_PATH,
+    FSP_SCALERS_PATH,
+    IMAGES_PATH,
+    STATIONS_CSV,
+    ar_to_aqhi,
+    compile_channel_scalers,
+    compile_patch_scaler,
+    load_images,
+    load_model,
+    load_scalers,
+    prepare_inputs,
+    predict_aqi,
+    predict_fsp,
+    state_dict_nbytes,
+)
+
+
+def _timed(fn, repeats: int):
+    result = fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return result, (time.perf_counter() - start) / repeats
+
+
+def quantization_report(images: np.ndarray, repeats: int = 3) -> dict:
+    """
+    Compares int8 dynamically quantized models with the fp32 models on the same
+    input: AQHI band agreement (after ar_to_aqhi), PM2.5 error, size and latency.
+    """
+    device = torch.device("cpu")
+    stations = load_station_cells(STATIONS_CSV)
+    X_aqi, X_fsp = prepare_inputs(
+        images,
+        compile_channel_scalers(load_scalers(AQI_SCALERS_PATH)),
+        compile_patch_scaler(load_scalers(FSP_SCALERS_PATH)),
+        stations,
+    )
+    fp32_aqi, fp32_fsp = load_model(AQI_MODEL_PATH, FSP_MODEL_PATH, device)
+    int8_aqi, int8_fsp = load_model(AQI_MODEL_PATH, FSP_MODEL_PATH, device, quantize=True)
+
+    ar_fp32, aqi_fp32_s = _timed(lambda: predict_aqi(fp32_aqi, X_aqi, device), repeats)
+    ar_int8, aqi_int8_s = _timed(lambda: predict_aqi(int8_aqi, X_aqi, device), repeats)
+    pm_fp32, fsp_fp32_s = _timed(lambda: predict_fsp(fp32_fsp, X_fsp, device), repeats)
+    pm_int8, fsp_int8_s = _timed(lambda: predict_fsp(int8_fsp, X_fsp, device), repeats)
+
+    band_diff = np.abs(ar_to_aqhi(ar_fp32) - ar_to_aqhi(ar_int8))
+    # format_output truncates PM2.5 with int(); compare both raw and as served
+    pm_err = np.abs(pm_fp32 - pm_int8)
+    served_pm_diff = np.abs(pm_fp32.astype(int) - pm_int8.astype(int))
+    return {
+        "aqhi": {
+            "band_agreement": float(np.mean(band_diff == 0)),
+            "max_band_difference": int(band_diff.max()),
+            "added_risk_max_abs_error": float(np.max(np.abs(ar_fp32 - ar_int8))),
+        },
+        "pm2_5": {
+            "mae": float(pm_err.mean()),
+            "rmse": float(np.sqrt(np.mean(pm_err**2))),
+            "max_abs_error": float(pm_err.max()),
+            "served_value_agreement": float(np.mean(served_pm_diff == 0)),
+        },
+        "size_bytes": {
+            "aqi_fp32": state_dict_nbytes(fp32_aqi),
+            "aqi_int8": state_dict_nbytes(int8_aqi),
+            "fsp_fp32": state_dict_nbytes(fp32_fsp),
+            "fsp_int8": state_dict_nbytes(int8_fsp),
+        },
+        "latency_seconds": {
+            "aqi_fp32": round(aqi_fp32_s, 4),
+            "aqi_int8": round(aqi_int8_s, 4),
+            "fsp_fp32": round(fsp_fp32_s, 4),
+            "fsp_int8": round(fsp_int8_s, 4),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy report for INFERENCE_QUANTIZE=true")
+    parser.add_argument("--images", default=IMAGES_PATH, help="past-48h tensor (.npy) to evaluate on")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="optional path to write the JSON report")
+    args = parser.parse_args()
+
+    report = quantization_report(load_images(args.images), repeats=args.repeats)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,128 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+import torch
+
+from lib.inference_settings import inference_context
+from lib.prediction import ar_to_aqhi, format_columnar, prepare_inputs
+from util.logging_util import get_logger
+from util.metrics_util import observe_stage
+
+logger = get_logger("rolling_forecast")
+
+
+class RollingForecaster:
+    """
+    Incremental forecaster over a rolling window of hourly frames.
+
+    Keeps the last `seq_length` (C, H, W) frames in a ring buffer together with
+    the per-station CNN embeddings of each frame for both models. Pushing a new
+    hour only runs the CNNs on that frame; the 47 unchanged frames reuse their
+    cached embeddings and only the LSTM heads are re-run.
+    """
+
+    def __init__(self, seq_length: int = 48):
+        self.seq_length = seq_length
+        self.latest_frame_time: Optional[datetime] = None
+        self._frames: Optional[np.ndarray] = None  # (seq, C, H, W) ring buffer
+        self._aqi_embeddings: Optional[np.ndarray] = None  # (S, seq, 64) aligned with _frames
+        self._fsp_embeddings: Optional[np.ndarray] = None  # (S, seq, cnn_embed) aligned with _frames
+        self._oldest = 0  # ring index of the oldest frame
+        self._bundle = None  # ModelBundle the cached embeddings were computed with
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._frames is not None
+
+    def _encode(self, frames: np.ndarray, bundle) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Runs both CNN encoders on (k, C, H, W) frames, returning (S, k, D) embeddings.
+        """
+        # (S, k, C, 3, 3) and (S, k, C-1, 15, 15)
+        X_aqi, X_fsp = prepare_inputs(frames, bundle.aqi_scalers, bundle.fsp_scaler, bundle.station_cells)
+        S, k = X_aqi.shape[:2]
+        with inference_context():
+            aqi_in = torch.tensor(np.ascontiguousarray(X_aqi)).to(bundle.device).reshape(S * k, *X_aqi.shape[2:])
+            fsp_in = torch.tensor(np.ascontiguousarray(X_fsp)).to(bundle.device).reshape(S * k, *X_fsp.shape[2:])
+            aqi_emb = bundle.aqi_model.cnn(aqi_in).cpu().numpy()
+            fsp_emb = bundle.fsp_model.encoder(fsp_in).cpu().numpy()
+        return aqi_emb.reshape(S, k, -1), fsp_emb.reshape(S, k, -1)
+
+    def bootstrap(self, images: np.ndarray, bundle, latest_frame_time: datetime):
+        """
+        Fills the window from a full (T, C, H, W) tensor whose last frame is at latest_frame_time.
+        """
+        if images.shape[0] < self.seq_length:
+            raise ValueError(f"Need at least {self.seq_length} frames to bootstrap, got {images.shape[0]}.")
+        frames = np.array(images[-self.seq_length:], dtype=np.float32)
+        with observe_stage("rolling_bootstrap"):
+            aqi_emb, fsp_emb = self._encode(frames, bundle)
+        with self._lock:
+            self._frames = frames
+            self._aqi_embeddings, self._fsp_embeddings = aqi_emb, fsp_emb
+            self._oldest = 0
+            self._bundle = bundle
+            self.latest_frame_time = latest_frame_time
+        logger.info("Rolling window bootstrapped", extra={"latest_frame": f"{latest_frame_time:%Y-%m-%d %H:%M}"})
+
+    def push(self, frame: np.ndarray, bundle, frame_time: datetime):
+        """
+        Replaces the oldest frame with the newest hourly (C, H, W) frame.
+        """
+        if not self.ready:
+            raise RuntimeError("Rolling window has not been bootstrapped.")
+        frame = np.asarray(frame, dtype=np.float32).reshape(self._frames.shape[1:])
+        with self._lock:
+            if bundle is not self._bundle:
+                self._reencode(bundle)
+            with observe_stage("rolling_encode_frame"):
+                aqi_emb, fsp_emb = self._encode(frame[np.newaxis], bundle)
+            slot = self._oldest
+            self._frames[slot] = frame
+            self._aqi_embeddings[:, slot] = aqi_emb[:, 0]
+            self._fsp_embeddings[:, slot] = fsp_emb[:, 0]
+            self._oldest = (slot + 1) % self.seq_length
+            self.latest_frame_time = frame_time
+
+    def _reencode(self, bundle):
+        # Models or scalers were reloaded; cached embeddings no longer match them
+        self._aqi_embeddings, self._fsp_embeddings = self._encode(self._frames, bundle)
+        self._bundle = bundle
+
+    def missing_frame_times(self, now: datetime) -> list[datetime]:
+        """
+        Hourly frame times after the newest frame in the window, up to the hour of `now`.
+        """
+        if self.latest_frame_time is None:
+            return []
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        times = []
+        frame_time = self.latest_frame_time + timedelta(hours=1)
+        while frame_time <= current_hour:
+            times.append(frame_time)
+            frame_time += timedelta(hours=1)
+        return times
+
+    def forecast(self, bundle) -> dict:
+        """
+        Forecasts the 24 hours after the newest frame from the cached embeddings,
+        as format_columnar arrays.
+        """
+        with self._lock:
+            if bundle is not self._bundle:
+                self._reencode(bundle)
+            order = (self._oldest + np.arange(self.seq_length)) % self.seq_length
+            aqi_emb = self._aqi_embeddings[:, order]
+            fsp_emb = self._fsp_embeddings[:, order]
+            start_hour = self.latest_frame_time.hour + 1
+        with observe_stage("rolling_forecast"), inference_context():
+            ar = bundle.aqi_model.forward_embeddings(torch.tensor(aqi_emb).to(bundle.device)).cpu().numpy()
+            station_idx = torch.arange(fsp_emb.shape[0]).to(bundle.device)
+            fsp = bundle.fsp_model.forward_embeddings(torch.tensor(fsp_emb).to(bundle.device), station_idx).cpu().numpy()
+        return format_columnar(ar_to_aqhi(ar), fsp, bundle.station_names, start_hour=start_hour)
+
+
+rolling_forecaster = RollingForecaster()
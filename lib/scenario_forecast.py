@@ -0,0 +1,162 @@
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lib.images_to_patches import images_to_patches
+from lib.inference_settings import current_settings
+from lib.prediction import (
+    AQI_CHANNEL,
+    AQI_PATCH_SIZE,
+    FSP_PATCH_SIZE,
+    IMAGES_PATH,
+    ar_to_aqhi,
+    format_columnar,
+    load_images,
+    prepare_inputs_from_patches,
+    run_inference,
+)
+from util.metrics_util import observe_stage
+
+# Stations per micro-batch when INFERENCE_BATCH_SIZE is unset: 4 x 48 frames keep the
+# CNN activations in cache, about a third cheaper per row than whole 17-station runs
+SCENARIO_BATCH_SIZE = 4
+
+
+@dataclass(frozen=True)
+class ChannelPerturbation:
+    """
+    A change to one input channel over all 48 frames: the channel's grid is
+    shifted by (shift_rows, shift_cols) cells (edge cells repeat, as in patch
+    extraction), then each value becomes value * scale + offset.
+    """
+    channel: int
+    scale: float = 1.0
+    offset: float = 0.0
+    shift_rows: int = 0
+    shift_cols: int = 0
+
+
+def _combine(perturbations: Sequence[ChannelPerturbation]) -> Dict[int, Tuple[int, int, float, float]]:
+    # Shifts commute with the affine part, so each channel reduces to one shift and one x * a + b
+    combined: Dict[int, Tuple[int, int, float, float]] = {}
+    for p in perturbations:
+        dr, dc, a, b = combined.get(p.channel, (0, 0, 1.0, 0.0))
+        combined[p.channel] = (dr + p.shift_rows, dc + p.shift_cols, a * p.scale, b * p.scale + p.offset)
+    return combined
+
+
+def _shifted_channel_patches(images: np.ndarray, station_cells: np.ndarray, channel: int, shift_rows: int, shift_cols: int) -> np.ndarray:
+    # (T, S, P, P) patches of channel on the grid shifted by (shift_rows, shift_cols), edges clamped
+    _, _, H, W = images.shape
+    pad = FSP_PATCH_SIZE // 2
+    offsets = np.arange(-pad, pad + 1)
+    rows = np.clip(np.clip(station_cells[:, 0, np.newaxis] + offsets, 0, H - 1) - shift_rows, 0, H - 1)
+    cols = np.clip(np.clip(station_cells[:, 1, np.newaxis] + offsets, 0, W - 1) - shift_cols, 0, W - 1)
+    plane = np.asarray(images[:, channel], dtype=np.float32)  # Only this channel is read
+    return plane[:, rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+
+
+def _perturbed_patches(images: np.ndarray, patches: np.ndarray, station_cells: np.ndarray, channel: int,
+                       params: Tuple[int, int, float, float]) -> np.ndarray:
+    # (T, S, 15, 15) raw patches of channel after one combined perturbation (see _combine)
+    dr, dc, a, b = params
+    raw = patches[:, channel] if (dr, dc) == (0, 0) else _shifted_channel_patches(images, station_cells, channel, dr, dc)
+    return raw * np.float32(a) + np.float32(b)
+
+
+def scenario_forecast(bundle, scenarios: Sequence[Tuple[str, Sequence[ChannelPerturbation]]], images: Optional[np.ndarray] = None) -> dict:
+    """
+    Forecasts the baseline and every (name, perturbations) scenario in one
+    batched forward pass per model over their distinct inputs, returning each
+    scenario's AQHI/PM2.5 ([station][hour], as in format_columnar) and its
+    delta from the baseline.
+    """
+    with observe_stage("scenario_forecast"):
+        return _scenario_forecast(bundle, scenarios, images)
+
+
+def _variants(scenarios, fsp_only: bool) -> tuple[list, list[int]]:
+    # Distinct model inputs as combined perturbations, the unperturbed baseline first, and each run's index into them
+    variants, runs = [()], [0]
+    for _, perturbations in scenarios:
+        combined = _combine(perturbations)
+        key = tuple(sorted(
+            (channel, params) for channel, params in combined.items()
+            if params != (0, 0, 1.0, 0.0) and not (fsp_only and channel == AQI_CHANNEL)
+        ))
+        if key not in variants:
+            variants.append(key)
+        runs.append(variants.index(key))
+    return variants, runs
+
+
+def _scenario_forecast(bundle, scenarios, images) -> dict:
+    images = load_images(IMAGES_PATH) if images is None else images
+    n_channels = images.shape[1]
+    for _, perturbations in scenarios:
+        for p in perturbations:
+            if not 0 <= p.channel < n_channels:
+                raise ValueError(f"channel must be between 0 and {n_channels - 1}, got {p.channel}.")
+            if not np.isfinite([p.scale, p.offset]).all():
+                raise ValueError("scale and offset must be finite.")
+
+    # Only distinct inputs go through each model: identity or repeated scenarios share a row block,
+    # and a scenario that only perturbs the AQI channel reuses the baseline PM2.5 (the FSP model never sees it)
+    aqi_variants, aqi_runs = _variants(scenarios, fsp_only=False)
+    fsp_variants, fsp_runs = _variants(scenarios, fsp_only=True)
+
+    # Raw patches and the scaled baseline inputs are computed once for every scenario
+    patches = images_to_patches(images, bundle.station_cells, FSP_PATCH_SIZE)  # (T, C, S, 15, 15)
+    X_aqi, X_fsp = prepare_inputs_from_patches(patches, bundle.aqi_scalers, bundle.fsp_scaler)  # (S, T, C, H, W)
+    n_stations = X_aqi.shape[0]
+    batch_aqi = np.empty((len(aqi_variants),) + X_aqi.shape, dtype=np.float32)
+    batch_fsp = np.empty((len(fsp_variants),) + X_fsp.shape, dtype=np.float32)
+    batch_aqi[:] = X_aqi
+    batch_fsp[:] = X_fsp
+
+    # Each variant rescales only the channels it perturbs (the scalers are affine per channel)
+    lo = FSP_PATCH_SIZE // 2 - AQI_PATCH_SIZE // 2
+    aqi_scaler, fsp_scaler = bundle.aqi_scalers, bundle.fsp_scaler
+
+    for run, variant in enumerate(aqi_variants[1:], start=1):
+        for channel, params in variant:
+            raw = _perturbed_patches(images, patches, bundle.station_cells, channel, params)[..., lo : lo + AQI_PATCH_SIZE, lo : lo + AQI_PATCH_SIZE]
+            scaled = raw * aqi_scaler.scale[0, channel, 0] + aqi_scaler.offset[0, channel, 0]
+            batch_aqi[run, :, :, channel] = scaled.transpose(1, 0, 2, 3)
+    for run, variant in enumerate(fsp_variants[1:], start=1):
+        for channel, params in variant:
+            fsp_channel = channel - (channel > AQI_CHANNEL)
+            scaled = _perturbed_patches(images, patches, bundle.station_cells, channel, params) * fsp_scaler.scale[0, fsp_channel, 0] + fsp_scaler.offset[0, fsp_channel, 0]
+            batch_fsp[run, :, :, fsp_channel] = scaled.transpose(1, 0, 2, 3)
+    del patches  # Only the stacked batches are needed from here on
+
+    # One pass per model over the stacked variants, in micro-batches: a single
+    # (variants x 17 x 48)-frame CNN batch would run slower per row than separate forecasts
+    settings = current_settings()
+    settings = replace(settings, batch_size=settings.batch_size or SCENARIO_BATCH_SIZE)
+    ar, fsp = run_inference(
+        bundle.aqi_runner, bundle.fsp_runner,
+        batch_aqi.reshape((-1,) + X_aqi.shape[1:]), batch_fsp.reshape((-1,) + X_fsp.shape[1:]),
+        bundle.device, settings, station_idx=np.tile(np.arange(n_stations), len(fsp_variants)),
+    )
+    aqhi = ar_to_aqhi(ar).reshape(len(aqi_variants), n_stations, -1)[aqi_runs]
+    fsp = fsp.reshape(len(fsp_variants), n_stations, -1)[fsp_runs]
+
+    baseline = format_columnar(aqhi[0], fsp[0], bundle.station_names)
+    results: List[dict] = []
+    for run, (name, _) in enumerate(scenarios, start=1):
+        columns = format_columnar(aqhi[run], fsp[run], bundle.station_names)
+        results.append({
+            "name": name,
+            "aqi": columns["aqi"],
+            "pm2_5": columns["pm2_5"],
+            "delta_aqi": (np.array(columns["aqi"]) - np.array(baseline["aqi"])).tolist(),
+            "delta_pm2_5": (np.array(columns["pm2_5"]) - np.array(baseline["pm2_5"])).tolist(),
+        })
+    return {
+        "stations": baseline["stations"],
+        "hours": baseline["hours"],
+        "baseline": {"aqi": baseline["aqi"], "pm2_5": baseline["pm2_5"]},
+        "scenarios": results,
+    }
@@ -1,56 +1,124 @@
-from fastapi import FastAPI, Query, Depends
+from fastapi import FastAPI, Query, Depends, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import request_validation_exception_handler
 from service.station_service import StationService
-from service.air_quality_service import AirQualityService
-from sqlmodel import Session
-from database import create_db_and_tables, get_session
+from service.air_quality_service import AirQualityService, inference_executor, upstream_client
+from service.real_time_snapshot_service import RealTimeSnapshotService
+from service.observation_ingest_service import ObservationIngestService
+from service.history_service import HISTORY_AGGREGATES, HISTORY_KINDS, HISTORY_RESOLUTIONS, forecast_columns, history_archive
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import create_db_and_tables, engine, get_session
 from dotenv import load_dotenv
 import os
 import shutil
+import math
 import json
-from util.cache_util import InMemoryCache
-from datetime import timedelta
-from typing import Optional, List, Dict, Any
+import time
+import asyncio
+from util.cache_util import InMemoryCache, create_cache_backend
+from util.leader_util import LeaderElection
+from util.response_util import negotiate_media_type, prepare_response, serve_prepared_response
+from util.logging_util import configure_logging, get_logger
+from util.metrics_util import MetricsMiddleware, instrument_job, render_metrics
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Callable
 from contextlib import asynccontextmanager
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from tzlocal import get_localzone
 from lib.google_cloud import download_blob_to_file
+from lib.model_registry import model_registry
+from lib.prediction import IMAGES_PATH, load_images, ensure_float32_tensor, tensor_end_time
+from lib.rolling_forecast import rolling_forecaster
+from lib.grid_forecast import GRID_VARIABLES, validate_bbox
+from model.scenario_model import ScenarioRequest
+from lib.forecast_index import FORECAST_FIELDS, ROWS_MEDIA_TYPE, ForecastIndex, encode_columnar, forecast_media_types
+from lib.inference_settings import INFERENCE_SETTINGS_PATH, InferenceSettings, apply_settings, autotune, current_settings, load_tuned_settings
+from dataclasses import asdict
+import numpy as np
 
 # Load environment variables from .env file
 load_dotenv()
+configure_logging()
+logger = get_logger("main")
 
 origins = json.loads(os.getenv("ALLOWED_ORIGINS", '["http://localhost:3000","https://hku-capstone-project-458309.df.r.appspot.com"]'))
 station_service = StationService()
 air_quality_service = AirQualityService()
-in_memory_cache = InMemoryCache(default_ttl_seconds=timedelta(days=1).total_seconds())
+REALTIME_POLL_SECONDS = int(os.getenv("REALTIME_POLL_SECONDS", "300"))
+real_time_snapshot_service = RealTimeSnapshotService(
+    air_quality_service,
+    max_age_seconds=float(os.getenv("REALTIME_SNAPSHOT_MAX_AGE_SECONDS", str(REALTIME_POLL_SECONDS * 2))),
+)
+OBSERVATION_INGEST_ENABLED = os.getenv("OBSERVATION_INGEST_ENABLED", "false").lower() == "true"
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "false").lower() == "true"
+HISTORY_MAX_DAYS = int(os.getenv("HISTORY_MAX_DAYS", "92"))
+observation_ingest_service = ObservationIngestService(
+    engine,
+    batch_size=int(os.getenv("OBSERVATION_INGEST_BATCH_SIZE", "500")),
+    database_enabled=OBSERVATION_INGEST_ENABLED,
+    archive=history_archive if HISTORY_ENABLED else None,
+)
+in_memory_cache = InMemoryCache(default_ttl_seconds=timedelta(days=1).total_seconds(), backend=create_cache_backend())
+leader_election = LeaderElection(os.getenv("LEADER_LOCK_PATH", "/tmp/aqf_leader.lock"))
+FOLLOWER_WAIT_SECONDS = float(os.getenv("FORECAST_FOLLOWER_WAIT_SECONDS", "30"))
+FORECAST_MAX_AGE_SECONDS = int(os.getenv("FORECAST_MAX_AGE_SECONDS", "600"))
+INCREMENTAL_FORECAST_ENABLED = os.getenv("INCREMENTAL_FORECAST_ENABLED", "false").lower() == "true"
+FORECAST_RESPONSE_CACHE_KEY = "forecast-air-quality-response"
+FORECAST_INDEX_CACHE_KEY = "forecast-air-quality-index"
+FORECAST_FORMATS_CACHE_KEY = "forecast-air-quality-formats" # {media type: PreparedResponse} for the columnar formats
+FORECAST_ETAG_CACHE_KEY = "forecast-air-quality-etag" # ETag of the published run, set last; keys the per-process copies below
+FORECAST_MEDIA_TYPES = forecast_media_types()
+FILTERED_COMPRESS_MIN_BYTES = 1024 # Smaller filtered responses are sent uncompressed
+GRID_FORECAST_ENABLED = os.getenv("GRID_FORECAST_ENABLED", "false").lower() == "true"
+GRID_FORECAST_CACHE_KEY = "forecast-grid"
+SCENARIO_FORECAST_ENABLED = os.getenv("SCENARIO_FORECAST_ENABLED", "false").lower() == "true"
+SCENARIO_MAX_COUNT = int(os.getenv("SCENARIO_MAX_COUNT", "16"))
+CACHE_SWEEP_SECONDS = int(os.getenv("CACHE_SWEEP_SECONDS", "60"))
+INFERENCE_AUTOTUNE = os.getenv("INFERENCE_AUTOTUNE", "false").lower() == "true"
+
+def is_leader() -> bool:
+    # Without a shared cache backend every worker has to compute its own forecast
+    return not in_memory_cache.backend.shared or leader_election.is_leader
 
 scheduler = AsyncIOScheduler(timezone=get_localzone())
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     scheduler.start()
+    # Warm the real-time snapshot in the background while the forecast is prepared
+    # (keep a reference so the task is not garbage collected)
+    snapshot_warmup = asyncio.create_task(refresh_real_time_snapshot())
+    if in_memory_cache.backend.shared:
+        leader_election.try_acquire()
     
     # try:
-    #     create_db_and_tables()
+    #     await create_db_and_tables()
     # except Exception as e:
     #     print(f"Database Connection ERROR: Failed to connect Database: {e}")
     
-    try:
+    # Each worker only uses its share of the cores (see lib/inference_settings.py)
+    apply_settings(current_settings())
+    # Only the leader prepares and publishes the forecast; followers read it from the shared cache
+    if is_leader():
+        try:
+            model_registry.load()
+        except Exception:
+            logger.exception("Failed to load models")
+
+        if INFERENCE_AUTOTUNE and load_tuned_settings() is None:
+            await tune_inference_settings()
+
         await clear_forecasting_cache()
         await batch_download_image_data()
-    except Exception as e:
-        print(f"Machine Learning Preparing Failed: Failed to load ml image data: {e}")
-    
-    try:
-        with MockSession() as session:
-            print("Startup: Fetching initial air quality data...")
-            response_data = await air_quality_service.get_air_quality_forecast_v2(session)
-            in_memory_cache.set("forecast-air-quality", response_data)
-            print("Startup: Cache preloaded successfully!")
-    except Exception as e:
-        print(f"Startup ERROR: Failed to preload cache: {e}")
+        await preload_forecasting_cache()
+        await incremental_forecast_update()
+    else:
+        logger.info("Worker is a follower, reading forecasts published by the leader", extra={"pid": os.getpid()})
     
     yield
     scheduler.shutdown()
+    inference_executor.shutdown()
+    await upstream_client.aclose()
 
 app = FastAPI(
     title="HKU Air Quality Forecasting API",
@@ -68,6 +136,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    # The default 422 body echoes each invalid input, and a rejected NaN/Infinity cannot be encoded as JSON
+    errors = [
+        {**error, "input": str(error["input"])} if isinstance(error.get("input"), float) and not math.isfinite(error["input"]) else error
+        for error in exc.errors()
+    ]
+    return await request_validation_exception_handler(request, RequestValidationError(errors, body=exc.body))
 
 class MockSession:
     """
@@ -75,7 +153,7 @@ class MockSession:
     and provides dummy methods for common session operations.
     """
     def __enter__(self):
-        print("Mock Session opened.")
+        logger.debug("Mock Session opened")
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -86,16 +164,16 @@ class MockSession:
 
     # Add any other methods your real Session object might have, empty commit/rollback etc.
     def add(self, obj):
-        print(f"Mock Session: Added object {obj}")
+        logger.debug("Mock Session: Added object", extra={"object": obj})
         pass
     def commit(self):
-        print("Mock Session: Committed changes.")
+        logger.debug("Mock Session: Committed changes")
         pass
     def rollback(self):
-        print("Mock Session: Rolled back changes.")
+        logger.debug("Mock Session: Rolled back changes")
         pass
     def refresh(self, obj):
-        print(f"Mock Session: Refreshed object {obj}")
+        logger.debug("Mock Session: Refreshed object", extra={"object": obj})
         pass
 
 def get_session_mock():
@@ -111,65 +189,413 @@ def get_session_mock():
 # Get all stations
 @app.get("/api/stations/")
 async def get_stations( *,
-    session: Session = Depends(get_session)):
+    session: AsyncSession = Depends(get_session)):
     return await station_service.get_stations(session)
+
+# Get the stations nearest to a location
+@app.get("/api/stations/nearest")
+async def get_nearest_stations(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude of the location"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude of the location"),
+    limit: int = Query(1, ge=1, description="Number of stations to return"),
+):
+    return station_service.get_nearest_stations(lat, lon, limit)
      
 # Get real-time air quality (all stations or specific station)
 @app.get("/api/real-time-air-quality/")
 async def get_real_time_air_quality( *,
-    session: Session = Depends(get_session),
+    response: Response,
+    session: AsyncSession = Depends(get_session),
     station: Optional[str] = Query(None, description="Filter by station name (optional)")
 ):
-    return await air_quality_service.get_real_time_air_quality(session,station)
+    snapshot = await real_time_snapshot_service.get_snapshot(session)
+    response.headers["Age"] = str(snapshot.age_seconds())
+    return snapshot.aqhi_for_station(station)
 
 # Get real-time analysis air quality (all stations or specific station)
 @app.get("/api/real-time-analysis-air-quality/")
-async def get_real_time_air_quality( *,
-    session: Session = Depends(get_session)
+async def get_real_time_analysis_air_quality( *,
+    response: Response,
+    session: AsyncSession = Depends(get_session)
 ):
-    return await air_quality_service.get_real_time_aq_analysis(session)
+    snapshot = await real_time_snapshot_service.get_snapshot(session)
+    response.headers["Age"] = str(snapshot.age_seconds())
+    return snapshot.analysis
+
+def publish_forecast(columns):
+    # Serialize and compress once per forecast run; cache hits only send bytes.
+    # The row JSON is joined from the index's per-row bytes, built from the forecast arrays
+    index = ForecastIndex.from_columnar(columns)
+    prepared = prepare_response(index.select())
+    in_memory_cache.set(FORECAST_RESPONSE_CACHE_KEY, prepared)
+    in_memory_cache.set(FORECAST_INDEX_CACHE_KEY, index)
+    in_memory_cache.set(FORECAST_FORMATS_CACHE_KEY, {
+        media_type: prepare_response(encode_columnar(columns, media_type), media_type)
+        for media_type in FORECAST_MEDIA_TYPES[1:]
+    })
+    in_memory_cache.set(FORECAST_ETAG_CACHE_KEY, prepared.etag)
+
+_published_copies: Dict[str, tuple] = {} # {cache key: (run ETag, value)}, this process's copies of the published run
 
-@app.post("/api/forecast-air-quality/", response_model= List[Dict[str, Any]])
+def get_published(key: str):
+    # A shared (SQLite) backend unpickles on every get; only the small ETag is read per request,
+    # and the value is read again only after a new run has been published
+    etag = in_memory_cache.get(FORECAST_ETAG_CACHE_KEY)
+    if etag is None:
+        return in_memory_cache.get(key)
+    copy = _published_copies.get(key)
+    if copy is not None and copy[0] == etag:
+        return copy[1]
+    value = in_memory_cache.get(key)
+    if value is not None:
+        _published_copies[key] = (etag, value)
+    return value
+
+async def wait_for_published(key: str, read: Callable[[str], Any] = get_published):
+    # Polls read(key) for up to FOLLOWER_WAIT_SECONDS while the leader publishes; None if it never appears
+    deadline = time.monotonic() + FOLLOWER_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        value = read(key)
+        if value is not None:
+            return value
+    return None
+
+async def get_forecast_response(session):
+    prepared = get_published(FORECAST_RESPONSE_CACHE_KEY)
+    if prepared:
+        return prepared
+
+    # Followers give the leader a chance to publish before computing themselves
+    if not is_leader():
+        prepared = await wait_for_published(FORECAST_RESPONSE_CACHE_KEY)
+        if prepared:
+            return prepared
+
+    # If not in cache or expired, fetch from source and cache it
+    columns = await air_quality_service.get_air_quality_forecast_v2(session)
+    publish_forecast(columns) # Cache for default
+    return get_published(FORECAST_RESPONSE_CACHE_KEY)
+
+async def get_forecast_index(session) -> ForecastIndex:
+    index = get_published(FORECAST_INDEX_CACHE_KEY)
+    if index is None:
+        await get_forecast_response(session) # Published together with the full response
+        index = get_published(FORECAST_INDEX_CACHE_KEY)
+    return index
+
+def _split_values(values: Optional[List[str]]) -> List[str]:
+    # Accepts repeated parameters and comma-separated lists alike
+    return [v.strip() for value in values or [] for v in value.split(",") if v.strip()]
+
+# Get forecast air quality (GET is cacheable by browsers and CDNs; POST kept for existing clients)
+@app.api_route("/api/forecast-air-quality/", methods=["GET", "POST"], response_model= List[Dict[str, Any]])
 async def get_air_quality_forecast(*,
-    session: Session = Depends(get_session)
+    request: Request,
+    station: Optional[List[str]] = Query(None, description="Station name(s), repeated or comma-separated; all stations when omitted"),
+    hour_from: int = Query(1, ge=1, le=24, description="First forecast hour (1-24)"),
+    hour_to: Optional[int] = Query(None, ge=1, le=24, description="Last forecast hour (1-24), inclusive"),
+    fields: Optional[str] = Query(None, description=f"Comma-separated subset of {FORECAST_FIELDS}"),
+    session: AsyncSession = Depends(get_session)
 ):
-    cached_data = in_memory_cache.get("forecast-air-quality")
-    if cached_data:
-        return cached_data
+    # Rows (application/json) by default; Accept selects the columnar JSON or msgpack format
+    media_type = negotiate_media_type(request.headers.get("accept", ""), FORECAST_MEDIA_TYPES)
+    vary = "Accept, Accept-Encoding"
+    if station is None and hour_from == 1 and hour_to is None and fields is None:
+        prepared = await get_forecast_response(session)
+        if media_type != ROWS_MEDIA_TYPE:
+            formats = get_published(FORECAST_FORMATS_CACHE_KEY) or {}
+            prepared = formats.get(media_type) or prepare_response(
+                encode_columnar((await get_forecast_index(session)).columnar(), media_type), media_type, fast=True
+            )
+        return serve_prepared_response(request, prepared, max_age=FORECAST_MAX_AGE_SECONDS, vary=vary)
 
-    # If not in cache or expired, fetch from source and cache it
-    response_data = await air_quality_service.get_air_quality_forecast_v2(session)
-    in_memory_cache.set("forecast-air-quality", response_data) # Cache for default         
-    return response_data
+    index = await get_forecast_index(session)
+    selection = (_split_values(station), hour_from, hour_to, _split_values([fields] if fields else None))
+    try:
+        if media_type == ROWS_MEDIA_TYPE:
+            body = index.select(*selection)
+        else:
+            body = encode_columnar(index.columnar(*selection), media_type)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    prepared = prepare_response(body, media_type, compress=len(body) >= FILTERED_COMPRESS_MIN_BYTES, fast=True)
+    return serve_prepared_response(request, prepared, max_age=FORECAST_MAX_AGE_SECONDS, vary=vary)
+
+async def archive_forecast(columns, start_time: datetime):
+    # Only the leader writes, so a forecast run is archived once however many workers computed it
+    if HISTORY_ENABLED and leader_election.try_acquire():
+        await asyncio.to_thread(history_archive.append, "forecast", forecast_columns(columns, start_time))
+
+# Get archived observations or forecasts for a station, raw or downsampled (hourly/daily mean, max or min)
+@app.get("/api/history/")
+async def get_history(
+    station: str = Query(..., description="Station name, e.g. Kwun Tong"),
+    kind: str = Query("observation", description=f"One of {HISTORY_KINDS}"),
+    start: Optional[datetime] = Query(None, description="Range start (ISO 8601); defaults to 7 days before end"),
+    end: Optional[datetime] = Query(None, description="Range end, exclusive (ISO 8601); defaults to now"),
+    resolution: str = Query("hourly", description=f"One of {HISTORY_RESOLUTIONS}"),
+    agg: str = Query("mean", description=f"Aggregate for hourly/daily buckets, one of {HISTORY_AGGREGATES}"),
+):
+    if not HISTORY_ENABLED:
+        raise HTTPException(status_code=404, detail="History is disabled. Set HISTORY_ENABLED=true to enable it.")
+    if kind not in HISTORY_KINDS:
+        raise HTTPException(status_code=422, detail=f"kind must be one of {HISTORY_KINDS}.")
+    if resolution not in HISTORY_RESOLUTIONS:
+        raise HTTPException(status_code=422, detail=f"resolution must be one of {HISTORY_RESOLUTIONS}.")
+    if agg not in HISTORY_AGGREGATES:
+        raise HTTPException(status_code=422, detail=f"agg must be one of {HISTORY_AGGREGATES}.")
+    end = end or datetime.now()
+    start = start or end - timedelta(days=7)
+    if (start.tzinfo is None) != (end.tzinfo is None):
+        raise HTTPException(status_code=422, detail="start and end must both have a timezone offset or both omit it.")
+    if start >= end:
+        raise HTTPException(status_code=422, detail="start must be before end.")
+    if end - start > timedelta(days=HISTORY_MAX_DAYS):
+        raise HTTPException(status_code=422, detail=f"The range may span at most {HISTORY_MAX_DAYS} days.")
+
+    series = await asyncio.to_thread(history_archive.query, kind, station, start, end, resolution, agg)
+    return {
+        "station": station,
+        "kind": kind,
+        "resolution": resolution,
+        "agg": None if resolution == "raw" else agg,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "series": series,
+    }
+
+async def get_grid_forecast(bbox=None):
+    # The full grid is computed once per forecast run and cached; a bounding box is always cropped from it.
+    # Like get_forecast_response, followers wait for the leader to publish, but never compute the grid
+    # themselves: None means no grid is ready yet
+    grid = in_memory_cache.get(GRID_FORECAST_CACHE_KEY)
+    if grid is None and not is_leader():
+        # Not part of the published run's ETag, so read straight from the cache
+        grid = await wait_for_published(GRID_FORECAST_CACHE_KEY, read=in_memory_cache.get)
+        if grid is None:
+            return None
+    if grid is None:
+        # Concurrent misses share a single grid computation
+        grid = await in_memory_cache.get_or_compute(GRID_FORECAST_CACHE_KEY, air_quality_service.get_grid_forecast)
+    return grid if bbox is None else grid.crop(bbox)
+
+# Get forecast rasters for every grid cell (float16 .npy array or a PNG heatmap tile)
+@app.get("/api/forecast-grid/")
+async def get_forecast_grid(
+    variable: str = Query("aqhi", description=f"One of {GRID_VARIABLES}"),
+    format: str = Query("npy", description="npy (float16 array) or png (heatmap tile)"),
+    hour: Optional[int] = Query(None, ge=1, le=24, description="Forecast hour (1-24); npy returns every hour when omitted"),
+    row_min: Optional[int] = Query(None, ge=0, description="Bounding box: first grid row (lat_idx)"),
+    row_max: Optional[int] = Query(None, description="Bounding box: grid row after the last one"),
+    col_min: Optional[int] = Query(None, ge=0, description="Bounding box: first grid column (lon_idx)"),
+    col_max: Optional[int] = Query(None, description="Bounding box: grid column after the last one"),
+):
+    if not GRID_FORECAST_ENABLED:
+        raise HTTPException(status_code=404, detail="Grid forecast mode is disabled. Set GRID_FORECAST_ENABLED=true to enable it.")
+    if variable not in GRID_VARIABLES:
+        raise HTTPException(status_code=422, detail=f"variable must be one of {GRID_VARIABLES}.")
+    if format not in ("npy", "png"):
+        raise HTTPException(status_code=422, detail="format must be npy or png.")
+
+    bbox = None
+    box = (row_min, row_max, col_min, col_max)
+    if any(v is not None for v in box):
+        if any(v is None for v in box):
+            raise HTTPException(status_code=422, detail="row_min, row_max, col_min and col_max must be given together.")
+        images = load_images(IMAGES_PATH)
+        try:
+            bbox = validate_bbox(box, (0, images.shape[2], 0, images.shape[3]))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    grid = await get_grid_forecast(bbox)
+    if grid is None:
+        raise HTTPException(status_code=503, detail="The grid forecast is being prepared. Retry shortly.", headers={"Retry-After": "30"})
+    headers = {
+        "Cache-Control": f"public, max-age={FORECAST_MAX_AGE_SECONDS}",
+        "X-Grid-Bbox": ",".join(str(v) for v in grid.bbox),
+        "X-Forecast-Start-Hour": str(grid.start_hour),
+    }
+    if format == "png":
+        return Response(content=grid.to_png_bytes(variable, hour or 1), media_type="image/png", headers=headers)
+    return Response(content=grid.to_npy_bytes(variable, hour), media_type="application/octet-stream", headers=headers)
+
+# Get forecasts for what-if scenarios: each perturbs input channels, and all run in one batch with the baseline
+@app.post("/api/forecast-scenarios/")
+async def post_forecast_scenarios(request: ScenarioRequest):
+    if not SCENARIO_FORECAST_ENABLED:
+        raise HTTPException(status_code=404, detail="Scenario forecasts are disabled. Set SCENARIO_FORECAST_ENABLED=true to enable them.")
+    if len(request.scenarios) > SCENARIO_MAX_COUNT:
+        raise HTTPException(status_code=422, detail=f"At most {SCENARIO_MAX_COUNT} scenarios may be requested at once.")
+    try:
+        return await air_quality_service.get_scenario_forecast(request.scenarios)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+# Get forecast model status (resident models, inference settings, executor metrics and cache statistics)
+@app.get("/api/forecast-model-status/")
+async def get_forecast_model_status():
+    return {
+        "models": model_registry.get_status(),
+        "inference": asdict(current_settings()),
+        "executor": inference_executor.get_status(),
+        "cache": in_memory_cache.get_status(),
+    }
+
+# Prometheus metrics (request latency, cache, forecast stages, upstream fetches, scheduler jobs)
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+async def tune_inference_settings():
+    # Benchmarks batch size / thread combinations on this host; followers load the saved result within 30s
+    try:
+        report = await inference_executor.run(
+            "inference-autotune", lambda: autotune(model_registry.get(), load_images(IMAGES_PATH))
+        )
+        apply_settings(InferenceSettings.from_env()) # Explicit INFERENCE_* variables still win over the tuned values
+        logger.info("Inference settings tuned", extra={**report["settings"], "seconds": report["seconds"], "path": INFERENCE_SETTINGS_PATH})
+    except Exception:
+        logger.exception("Inference settings auto-tune failed, keeping current settings", extra=asdict(current_settings()))
+
+# Scheduler Reload Inference Settings (followers started before the leader's auto-tune saved its result)
+@scheduler.scheduled_job('interval', seconds=30)
+@instrument_job("reload_inference_settings")
+async def reload_inference_settings():
+    if is_leader():
+        return
+    settings = InferenceSettings.from_env()
+    if settings != current_settings():
+        apply_settings(settings)
+        logger.info("Inference settings reloaded", extra=asdict(settings))
 
 # Scheduler download past 48 hour image data from GCS
 @scheduler.scheduled_job('cron', hour=0, minute=10)
+@instrument_job("batch_download_image_data")
 async def batch_download_image_data():    
+    if not is_leader():
+        return
     # Download image data from GCS
     bucket_name = os.getenv("GBS_BUCKET_NAME")
     source_file = os.getenv("GBS_SOURCE_FILE")
     destination_path = os.getenv("IMAGE_DESTINATION_PATH")
     move_path = os.getenv("IMAGE_MOVE_PATH")
-    try:
-        download_blob_to_file(bucket_name, source_file, destination_path)
-        if os.path.exists(destination_path):
-            os.makedirs(move_path, exist_ok=True)
-            # Construct full destination path
-            filename = os.path.basename(destination_path)
-            target_path = os.path.join(move_path, filename)
-            # Move the file
-            shutil.move(destination_path, target_path)
-            print(f"File moved to {target_path}")
-        else:
-            print(f"File not found at {destination_path}")
-
-    except Exception as e:
-        print(f"Download Image Data from GCS is failed: {e}")
+    download_blob_to_file(bucket_name, source_file, destination_path)
+    if destination_path and os.path.exists(destination_path):
+        os.makedirs(move_path, exist_ok=True)
+        # Construct full destination path
+        filename = os.path.basename(destination_path)
+        target_path = os.path.join(move_path, filename)
+        # Move the file
+        shutil.move(destination_path, target_path)
+        logger.info("Image data moved", extra={"path": target_path})
+        # Store float32 once on ingest so forecasts can memory-map it without conversion
+        await asyncio.to_thread(ensure_float32_tensor, target_path)
+        if INCREMENTAL_FORECAST_ENABLED:
+            # A fresh 48h tensor restarts the rolling window
+            await inference_executor.run("rolling-forecast-bootstrap", bootstrap_rolling_forecast)
+    else:
+        logger.warning("Downloaded image data not found", extra={"path": destination_path})
 
 # Scheduler Clear Forecasting Air Quality Cache
 @scheduler.scheduled_job('cron', hour=0, minute=5)
+@instrument_job("clear_forecasting_cache")
 async def clear_forecasting_cache():    
-    try:
-        in_memory_cache.invalidate("forecast-air-quality")
-    except Exception as e:
-        print(f"Error in clear forecasting cache: {e}")
\ No newline at end of file
+    if not is_leader():
+        return
+    in_memory_cache.invalidate(FORECAST_RESPONSE_CACHE_KEY)
+    in_memory_cache.invalidate(FORECAST_INDEX_CACHE_KEY)
+    in_memory_cache.invalidate(FORECAST_FORMATS_CACHE_KEY)
+    in_memory_cache.invalidate(FORECAST_ETAG_CACHE_KEY)
+    in_memory_cache.invalidate(GRID_FORECAST_CACHE_KEY)
+
+# Scheduler Preload Forecasting Air Quality Cache (leader computes and publishes for all workers)
+@scheduler.scheduled_job('cron', hour=0, minute=15)
+@instrument_job("preload_forecasting_cache")
+async def preload_forecasting_cache():
+    if not is_leader():
+        return
+    with MockSession() as session:
+        columns = await air_quality_service.get_air_quality_forecast_v2(session)
+        publish_forecast(columns)
+        logger.info("Forecast cache preloaded")
+    # The daily 48h tensor ends at midnight of the day it was downloaded, so the first forecast hour is 01:00
+    await archive_forecast(columns, tensor_end_time(IMAGES_PATH) + timedelta(hours=1))
+    if GRID_FORECAST_ENABLED:
+        in_memory_cache.set(GRID_FORECAST_CACHE_KEY, await air_quality_service.get_grid_forecast())
+        logger.info("Grid forecast preloaded")
+
+# Scheduler Leader Election (a follower takes over if the leader worker has exited)
+@scheduler.scheduled_job('interval', seconds=30)
+@instrument_job("elect_leader")
+async def elect_leader():
+    if not in_memory_cache.backend.shared or leader_election.is_leader:
+        return
+    if leader_election.try_acquire() and in_memory_cache.get(FORECAST_RESPONSE_CACHE_KEY) is None:
+        await preload_forecasting_cache()
+
+def bootstrap_rolling_forecast():
+    # The daily 48h tensor ends at midnight (forecast hours 01:00..24:00). An older day's
+    # tensor, kept after a failed download, is not bootstrapped under today's label
+    end_time = tensor_end_time(IMAGES_PATH)
+    if end_time.date() != datetime.now().date():
+        logger.warning("48h tensor is not today's, skipping rolling window bootstrap", extra={"tensor_end": f"{end_time:%Y-%m-%d %H:%M}"})
+        return
+    rolling_forecaster.bootstrap(load_images(IMAGES_PATH), model_registry.get(), end_time)
+
+def ingest_hourly_frames():
+    # Pull every hourly frame published since the newest one in the window, oldest first
+    bucket_name = os.getenv("GBS_BUCKET_NAME")
+    source_pattern = os.getenv("GBS_HOURLY_SOURCE_PATTERN") # strftime pattern, e.g. hourly/%Y%m%d%H.npy
+    if not source_pattern:
+        logger.warning("GBS_HOURLY_SOURCE_PATTERN is not set; skipping hourly frame ingestion")
+        return
+    destination_path = os.path.join(os.getenv("IMAGE_MOVE_PATH", "./lib"), "latest_frame.npy")
+    for frame_time in rolling_forecaster.missing_frame_times(datetime.now()):
+        if not download_blob_to_file(bucket_name, frame_time.strftime(source_pattern), destination_path):
+            logger.info("Hourly frame is not available yet", extra={"frame_time": f"{frame_time:%Y-%m-%d %H:%M}"})
+            break
+        rolling_forecaster.push(np.load(destination_path), model_registry.get(), frame_time)
+
+# Scheduler Incremental Forecast (ingest newest hourly frame and re-forecast from cached CNN embeddings)
+@scheduler.scheduled_job('cron', minute=20)
+@instrument_job("incremental_forecast_update")
+async def incremental_forecast_update():
+    if not INCREMENTAL_FORECAST_ENABLED or not is_leader():
+        return
+    if not rolling_forecaster.ready:
+        await inference_executor.run("rolling-forecast-bootstrap", bootstrap_rolling_forecast)
+        if not rolling_forecaster.ready:
+            return
+    await inference_executor.run("rolling-forecast-ingest", ingest_hourly_frames)
+    columns = await inference_executor.run("rolling-forecast", rolling_forecaster.forecast, model_registry.get())
+    publish_forecast(columns)
+    logger.info("Incremental forecast published", extra={"latest_frame": f"{rolling_forecaster.latest_frame_time:%Y-%m-%d %H:%M}"})
+    await archive_forecast(columns, rolling_forecaster.latest_frame_time + timedelta(hours=1))
+
+# Scheduler Real-time Snapshot (each worker polls the AQHI and lamppost feeds into its own snapshot;
+# only the leader appends the poll to the AirQuality table and the history archive)
+@scheduler.scheduled_job('interval', seconds=REALTIME_POLL_SECONDS)
+@instrument_job("refresh_real_time_snapshot")
+async def refresh_real_time_snapshot():
+    snapshot = await real_time_snapshot_service.refresh()
+    if (OBSERVATION_INGEST_ENABLED or HISTORY_ENABLED) and leader_election.try_acquire():
+        await observation_ingest_service.ingest(snapshot)
+
+# Scheduler Cache Sweep (drops expired entries that were never read again)
+@scheduler.scheduled_job('interval', seconds=CACHE_SWEEP_SECONDS)
+@instrument_job("sweep_cache")
+async def sweep_cache():
+    in_memory_cache.sweep()
+
+# Scheduler History Compaction (merges yesterday's archive segments into one file per kind)
+@scheduler.scheduled_job('cron', hour=0, minute=30)
+@instrument_job("compact_history")
+async def compact_history():
+    if not HISTORY_ENABLED or not leader_election.try_acquire():
+        return
+    yesterday = (datetime.now() - timedelta(days=1)).date()
+    for kind in HISTORY_KINDS:
+        await asyncio.to_thread(history_archive.compact, kind, yesterday)
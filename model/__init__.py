@@ -1,5 +1,6 @@
 from .air_quality import AirQualityData
 from .station_model import StationModel
+from .scenario_model import Perturbation, Scenario, ScenarioRequest
 
 # Optional: Shortcut to import all models at once
-__all__ = ["AirQualityData", "StationModel"]
\ No newline at end of file
+__all__ = ["AirQualityData", "StationModel", "Perturbation", "Scenario", "ScenarioRequest"]
\ No newline at end of file
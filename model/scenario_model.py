@@ -0,0 +1,17 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+class Perturbation(BaseModel):
+    channel: int = Field(ge=0, le=15, description="Input channel index (0-15) of the 48-hour image stack")
+    scale: float = Field(1.0, ge=0.0, le=10.0, allow_inf_nan=False, description="Factor applied to every value of the channel")
+    offset: float = Field(0.0, ge=-1000.0, le=1000.0, allow_inf_nan=False, description="Amount added to every value after scaling")
+    shift_rows: int = Field(0, ge=-64, le=64, description="Grid cells to shift the channel by, along rows")
+    shift_cols: int = Field(0, ge=-64, le=64, description="Grid cells to shift the channel by, along columns")
+
+class Scenario(BaseModel):
+    name: str = Field(min_length=1, max_length=64)
+    perturbations: List[Perturbation] = Field(default_factory=list)
+
+class ScenarioRequest(BaseModel):
+    scenarios: List[Scenario] = Field(min_length=1)
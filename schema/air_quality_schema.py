@@ -1,8 +1,12 @@
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 from typing import Optional
 from datetime import datetime
 
 class AirQuality(SQLModel, table=True):
+    # History queries filter by station and a report_datetime range
+    __table_args__ = (Index("ix_airquality_station_report_datetime", "station", "report_datetime"),)
+
     id: int | None = Field(default=None, primary_key=True)
     report_datetime: Optional[datetime] = None
     station: Optional[str] = None
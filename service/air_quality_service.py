@@ -1,18 +1,35 @@
 from fastapi import HTTPException
 import httpx
 import xml.etree.ElementTree as ET
-from service.station_service import StationService 
+from service.station_service import station_catalog
 from dotenv import load_dotenv
 import os
 from typing import Optional, List, Dict, Any
 from lib.prediction import forecast_aq
+from lib.grid_forecast import forecast_grid
+from lib.scenario_forecast import ChannelPerturbation, scenario_forecast
+from lib.model_registry import model_registry
+from lib.rolling_forecast import rolling_forecaster
+from util.executor_util import InferenceExecutor
+from util.http_util import UpstreamClient
+from util.logging_util import get_logger
 
 import asyncio
-from collections import defaultdict
+import hashlib
+import math
+from array import array
+
+import ijson
+import numpy as np
+import pandas as pd
+from util.aggregation_util import describe_by_group
 
 # Load environment variables from .env file
 load_dotenv()
-station_service = StationService()
+logger = get_logger("air_quality_service")
+inference_executor = InferenceExecutor(max_workers=int(os.getenv("FORECAST_EXECUTOR_WORKERS", "1")))
+GRID_TILE_SIZE = int(os.getenv("GRID_TILE_SIZE", "8"))
+upstream_client = UpstreamClient(timeout=10.0, ttl_seconds=float(os.getenv("UPSTREAM_CACHE_TTL_SECONDS", "60")))
 gov_data_mapping = {
     "Central and Western": "CENTRAL",
     "Kowloon City": "KWUN TONG",
@@ -22,11 +39,218 @@ gov_data_mapping = {
     "Yau Tsim Mong": "CAUSEWAY BAY",
 }
 
+
+def run_forecast():
+    # Runs on the inference executor; model (re)loading happens off the event loop too.
+    # Returns format_columnar arrays, which the published ForecastIndex and the archive are built from
+    bundle = model_registry.get()
+    if rolling_forecaster.ready:
+        # Incremental mode: only the LSTM heads run over cached frame embeddings
+        return rolling_forecaster.forecast(bundle)
+    return forecast_aq(bundle, columnar=True)
+
+
+def run_grid_forecast(bbox=None):
+    # Full-grid (or bounding box) forecast, tile by tile on the inference executor
+    return forecast_grid(model_registry.get(), bbox=bbox, tile_size=GRID_TILE_SIZE)
+
+
+def run_scenario_forecast(scenarios):
+    # scenarios: [(name, [ChannelPerturbation])]; the baseline and every scenario share one batched model run
+    return scenario_forecast(model_registry.get(), scenarios)
+
+
+def _parse_aqhi_item(item_elem: ET.Element) -> Optional[Dict[str, Any]]:
+    title_elem = item_elem.find('title')
+    description_elem = item_elem.find('description')
+    pub_date_elem = item_elem.find('pubDate')
+
+    district_name = title_elem.text.strip() if title_elem is not None else ""
+    description_text = description_elem.text.strip() if description_elem is not None else ""
+    pub_date = pub_date_elem.text if pub_date_elem is not None else ""
+
+    aqhi_str = None
+    risk = None
+
+    # Find the part after the second colon and before the final dash
+    parts_after_colon = description_text.split(': ', 1)
+    if len(parts_after_colon) > 1:
+        # This gets "2 Low - Wed, 25 Jun 2025 20:30"
+        aqhi_risk_date_part = parts_after_colon[1].strip()
+        
+        # Split by the first " - " to separate AQHI/Risk from date
+        aqhi_risk_components = aqhi_risk_date_part.split(' - ', 1)
+        if len(aqhi_risk_components) > 0:
+            aqhi_risk_str = aqhi_risk_components[0].strip() # This should be "2 Low" or "3 High"
+
+            # Split "2 Low" into AQHI and Risk
+            aqhi_and_risk = aqhi_risk_str.split(' ', 1)
+            if len(aqhi_and_risk) == 2:
+                aqhi_str = aqhi_and_risk[0].strip()
+                risk = aqhi_and_risk[1].strip()
+            elif len(aqhi_and_risk) == 1:
+                aqhi_str = aqhi_and_risk[0].strip()
+                risk = "N/A" # Default if risk level is missing
+
+    if aqhi_str is None or risk is None:
+        logger.warning("Could not parse AQHI/Risk, skipping item", extra={"description": description_text, "district": district_name})
+        return None
+
+    try:
+        aqi_value = int(aqhi_str)
+    except ValueError:
+        logger.warning("Could not convert AQHI to int, skipping item", extra={"aqhi": aqhi_str, "district": district_name})
+        return None
+
+    return {
+        'district': district_name,
+        'aqi': aqi_value,
+        'risk_level': risk,
+        'report_datetime': pub_date
+    }
+
+
+async def parse_aqhi_rss(response: httpx.Response) -> List[Dict[str, Any]]:
+    # Streams the AQHI RSS feed, handling each <channel><item> as soon as it closes
+    parser = ET.XMLPullParser(events=("start", "end"))
+    path: List[str] = []
+    districts = []
+
+    def drain():
+        for event, elem in parser.read_events():
+            if event == "start":
+                path.append(elem.tag)
+                continue
+            path.pop()
+            # Same items as root.findall('./channel/item')
+            if elem.tag == 'item' and len(path) == 2 and path[1] == 'channel':
+                district = _parse_aqhi_item(elem)
+                if district is not None:
+                    districts.append(district)
+                elem.clear() # Parsed items are not kept in the tree
+
+    async for chunk in response.aiter_bytes():
+        parser.feed(chunk)
+        drain()
+    parser.close()
+    drain()
+    return districts
+
+
+LAMPPOST_POLLUTANTS = ('pm2_5', 'no2', 'no')
+LAMPPOST_SOURCE_FIELDS = {'pm2_5': 'pm25', 'no2': 'no2', 'no': 'no'}
+
+
+def _as_float(value) -> float:
+    try:
+        return float(value) if value is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class LamppostColumns:
+    """
+    Column buffers of lamppost readings (district plus one float array per
+    pollutant, NaN when missing), filled one record at a time while parsing.
+    """
+
+    def __init__(self):
+        self.districts: List[str] = []
+        self.values = {pollutant: array('d') for pollutant in LAMPPOST_POLLUTANTS}
+
+    def add(self, item_data: Dict[str, Any]):
+        lamppost_info = item_data.get('lamppost') or {}
+        station_name = lamppost_info.get('district_en') 
+
+        # Ensure station_name is valid for grouping
+        if not station_name:
+            logger.debug("Lamppost item missing 'district_en', skipping", extra={"item": item_data, "sampled": True})
+            return
+
+        readings = [_as_float(item_data.get(LAMPPOST_SOURCE_FIELDS[p])) for p in LAMPPOST_POLLUTANTS]
+        if all(math.isnan(r) for r in readings):
+            return # A record without any reading does not count towards its district
+        self.districts.append(station_name)
+        for pollutant, reading in zip(LAMPPOST_POLLUTANTS, readings):
+            self.values[pollutant].append(reading)
+
+    def to_frame(self) -> pd.DataFrame:
+        columns = {pollutant: np.frombuffer(values, dtype=np.float64) for pollutant, values in self.values.items()}
+        return pd.DataFrame({'station': pd.Categorical(self.districts), **columns})
+
+    def results(self) -> List[Dict[str, Any]]:
+        """
+        Per-district averages (each pollutant over its own readings) plus the
+        count/mean/min/max/percentile distribution they came from.
+        """
+        aggregated_results = []
+        for group in describe_by_group(self.to_frame(), 'station', LAMPPOST_POLLUTANTS):
+            distribution = group['distribution']
+            aggregated_results.append({
+                'station': group['station'],
+                **{p: round(distribution[p]['mean']) if distribution[p]['mean'] is not None else None for p in LAMPPOST_POLLUTANTS},
+                'distribution': distribution,
+            })
+        return aggregated_results
+
+
+async def parse_lamppost_json(response: httpx.Response) -> List[Dict[str, Any]]:
+    # Streams the lamppost payload into column buffers as its bytes arrive,
+    # then aggregates every district in one vectorized pass
+    events = ijson.sendable_list()
+    parser = ijson.parse_coro(events, use_float=True)
+    aggregator = LamppostColumns()
+    builder = None
+
+    def drain():
+        nonlocal builder
+        for prefix, event, value in events:
+            if prefix == 'data':
+                if event not in ('start_array', 'end_array', 'null'):
+                    raise HTTPException(status_code=500, detail="Unexpected data format from external Lamppost API. Expected a list in 'data'.")
+                continue
+            if builder is None:
+                if prefix != 'data.item':
+                    continue
+                if event not in ('start_map', 'start_array'):
+                    continue # Scalar entries carry no lamppost record
+                builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            if prefix == 'data.item' and event in ('end_map', 'end_array'):
+                if isinstance(builder.value, dict):
+                    aggregator.add(builder.value)
+                builder = None
+        del events[:]
+
+    async for chunk in response.aiter_bytes():
+        parser.send(chunk)
+        drain()
+    parser.close()
+    drain()
+    return aggregator.results()
+
+
+def _round_or_none(value):
+    return round(value) if value is not None else None
+
+
 class AirQualityService:
         
     # Get forecasting air quality (all stations) version2
-    async def get_air_quality_forecast_v2(self, session):            
-        return forecast_aq()
+    async def get_air_quality_forecast_v2(self, session):
+        # Concurrent cache misses share one in-flight model run
+        return await inference_executor.run("forecast-air-quality", run_forecast)
+
+    # Get forecasting air quality rasters for every grid cell (or a bounding box of cells)
+    async def get_grid_forecast(self, bbox=None):
+        return await inference_executor.run(f"forecast-grid-{bbox}", run_grid_forecast, bbox)
+
+    # Get forecasts for what-if scenarios (perturbed input channels) next to the baseline
+    async def get_scenario_forecast(self, scenarios):
+        scenarios = [(s.name, [ChannelPerturbation(**p.model_dump()) for p in s.perturbations]) for s in scenarios]
+        # Identical concurrent requests share one in-flight run
+        key = hashlib.sha1(repr(scenarios).encode()).hexdigest()[:12]
+        return await inference_executor.run(f"scenario-{key}", run_scenario_forecast, scenarios)
     
     # Get real-time air quality (all stations or specific station)
     async def get_real_time_air_quality(self, session, station_filter: Optional[str] = None) -> List[Dict[str, Any]]:
@@ -34,68 +258,23 @@ class AirQualityService:
         if not AQHI_URL:
             raise HTTPException(status_code=500, detail="AQHI_API_URL environment variable is not set.")
         try:
-            all_stations = await station_service.get_stations(session)
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(AQHI_URL)
-                response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-                root = ET.fromstring(response.text)
-                items = []
-                stations_by_lower_name = {s.name.lower(): s for s in all_stations}
-                
-                for item_elem in root.findall('./channel/item'): # Use a distinct variable name for the element
-                    title_elem = item_elem.find('title')
-                    description_elem = item_elem.find('description')
-                    pub_date_elem = item_elem.find('pubDate')
-
-                    district_name = title_elem.text.strip() if title_elem is not None else ""
-                    description_text = description_elem.text.strip() if description_elem is not None else ""
-                    pub_date = pub_date_elem.text if pub_date_elem is not None else ""
-
-                    aqhi_str = None
-                    risk = None
-
-                    # Find the part after the second colon and before the final dash
-                    parts_after_colon = description_text.split(': ', 1)
-                    if len(parts_after_colon) > 1:
-                        # This gets "2 Low - Wed, 25 Jun 2025 20:30"
-                        aqhi_risk_date_part = parts_after_colon[1].strip()
-                        
-                        # Split by the first " - " to separate AQHI/Risk from date
-                        aqhi_risk_components = aqhi_risk_date_part.split(' - ', 1)
-                        if len(aqhi_risk_components) > 0:
-                            aqhi_risk_str = aqhi_risk_components[0].strip() # This should be "2 Low" or "3 High"
-
-                            # Split "2 Low" into AQHI and Risk
-                            aqhi_and_risk = aqhi_risk_str.split(' ', 1)
-                            if len(aqhi_and_risk) == 2:
-                                aqhi_str = aqhi_and_risk[0].strip()
-                                risk = aqhi_and_risk[1].strip()
-                            elif len(aqhi_and_risk) == 1:
-                                aqhi_str = aqhi_and_risk[0].strip()
-                                risk = "N/A" # Default if risk level is missing
-
-                    if aqhi_str is None or risk is None:
-                        print(f"Warning: Could not parse AQHI/Risk from description '{description_text}' for district '{district_name}'. Skipping this item.")
-                        continue
-
-                    station_data = stations_by_lower_name.get(district_name.lower())                    
-                    if (station_filter is None or station_filter.lower() == district_name.lower()) and station_data is not None:
-                        try:
-                            aqi_value = int(aqhi_str)
-                        except ValueError:
-                            print(f"Warning: Could not convert AQHI '{aqhi_str}' to int for district '{district_name}'. Skipping this item.")
-                            continue
-
-                        items.append({
-                            'id': station_data.id,
-                            'station': station_data.name,
-                            'latitude': station_data.latitude,
-                            'longitude': station_data.longitude,
-                            'aqi': aqi_value,
-                            'risk_level': risk,
-                            'report_datetime': pub_date
-                        })
-                return items
+            districts = await upstream_client.fetch(AQHI_URL, parse_aqhi_rss)
+            items = []
+
+            for district in districts:
+                district_name = district['district']
+                station_data = station_catalog.get_by_name(district_name)
+                if (station_filter is None or station_filter.lower() == district_name.lower()) and station_data is not None:
+                    items.append({
+                        'id': station_data.id,
+                        'station': station_data.name,
+                        'latitude': station_data.latitude,
+                        'longitude': station_data.longitude,
+                        'aqi': district['aqi'],
+                        'risk_level': district['risk_level'],
+                        'report_datetime': district['report_datetime']
+                    })
+            return items
         except httpx.HTTPStatusError as e:
             raise HTTPException(status_code=e.response.status_code, detail=f"External API HTTP error: {e.response.text}") from e
         except httpx.RequestError as e:
@@ -107,55 +286,14 @@ class AirQualityService:
     
     async def get_real_time_air_quality_particle(self, session):
         LAMPPORT_API_URL = os.getenv("LAMPPORT_API_URL","https://paqs.epd-asmg.gov.hk/data/data.json")
-        aggregated_data = defaultdict(lambda: {'pm25_sum': 0, 'no2_sum': 0, 'no_sum': 0, 'count': 0})
             
         if not LAMPPORT_API_URL:
             raise HTTPException(status_code=500, detail="LAMPPORT_API_URL environment variable is not set.")
             
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(LAMPPORT_API_URL)
-                response.raise_for_status()
-                response_data = response.json().get('data', [])
-                    
-                if not isinstance(response_data, list):
-                    raise HTTPException(status_code=500, detail="Unexpected data format from external Lamppost API. Expected a list in 'data'.")
-
-                for item_data in response_data:
-                    lamppost_info = item_data.get('lamppost', {})
-                    station_name = lamppost_info.get('district_en') 
-
-                    # Ensure station_name is valid for grouping
-                    if not station_name:
-                        print(f"Warning: Item missing 'district_en' in lamppost info: {item_data}")
-                        continue
-
-                    pm2_5 = item_data.get('pm25')
-                    no2 = item_data.get('no2')
-                    no = item_data.get('no')
-
-                    # Aggregate sums and count only if values are present (not None)
-                    if pm2_5 is not None:
-                        aggregated_data[station_name]['pm25_sum'] += pm2_5
-                    if no2 is not None:
-                        aggregated_data[station_name]['no2_sum'] += no2
-                    if no is not None:
-                        aggregated_data[station_name]['no_sum'] += no
-                        
-                    if pm2_5 is not None or no2 is not None or no is not None:
-                        aggregated_data[station_name]['count'] += 1
-
-            aggregated_results = []
-            for station, data in aggregated_data.items():
-                if data['count'] > 0:
-                    aggregated_results.append({
-                        'station': station,
-                        'pm2_5': round(data['pm25_sum'] / data['count']) if data['pm25_sum'] is not None else None,
-                        'no2': round(data['no2_sum'] / data['count']) if data['no2_sum'] is not None else None,
-                        'no': round(data['no_sum'] / data['count']) if data['no_sum'] is not None else None,
-                    })
-            return aggregated_results
-
+            return await upstream_client.fetch(LAMPPORT_API_URL, parse_lamppost_json)
+        except HTTPException:
+            raise
         except httpx.HTTPStatusError as e:
             raise HTTPException(status_code=e.response.status_code, detail=f"External API HTTP error: {e.response.text}") from e
         except httpx.RequestError as e:
@@ -169,6 +307,10 @@ class AirQualityService:
             self.get_real_time_air_quality(session),
             self.get_real_time_air_quality_particle(session)
         )
+        return self.consolidate_analysis(aqhi_response, aq_data_response)
+
+    # Join lamppost district averages onto the AQHI station they map to
+    def consolidate_analysis(self, aqhi_response, aq_data_response):
         consolidate_response = []
         aqhi_lookup = {item.get('station').upper(): item for item in aqhi_response}
         for aq_data_item in aq_data_response:
@@ -182,8 +324,9 @@ class AirQualityService:
                     'longitude': aqhi_item.get('longitude'),
                     'aqi': aqhi_item.get('aqi'),
                     'report_datetime': aqhi_item.get('report_datetime'),
-                    'pm2_5': round(aq_data_item.get('pm2_5')),
-                    'no': round(aq_data_item.get('no')),
-                    'no2': round(aq_data_item.get('no2')),
+                    'pm2_5': _round_or_none(aq_data_item.get('pm2_5')),
+                    'no': _round_or_none(aq_data_item.get('no')),
+                    'no2': _round_or_none(aq_data_item.get('no2')),
+                    'distribution': aq_data_item.get('distribution'),
                 })
         return consolidate_response    
\ No newline at end of file
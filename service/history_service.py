@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from tzlocal import get_localzone
+
+from util.logging_util import get_logger
+from util.sqlite_util import ProcessLocalConnection
+
+logger = get_logger("history")
+
+HISTORY_KINDS = ("observation", "forecast")
+HISTORY_RESOLUTIONS = ("raw", "hourly", "daily")
+HISTORY_AGGREGATES = ("mean", "max", "min")
+HISTORY_VARIABLES = ("aqi", "pm2_5")
+COMPACTED_SEGMENT = "compacted.npz"
+
+
+def _epoch(value: datetime) -> float:
+    # Naive datetimes are local time, like datetime.now() elsewhere in the service.
+    # Not truncated, so an exclusive range end keeps rows from earlier in its second
+    return value.timestamp()
+
+
+@lru_cache(maxsize=256)
+def _load_segment(path: str, mtime_ns: int) -> Dict[str, np.ndarray]:
+    # Segments are immutable once written; mtime_ns keys out a compacted file that reused a path
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def observation_columns(rows: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Columns for AirQuality-shaped rows (report_datetime, station, aqi, pm2_5).
+    """
+    rows = [row for row in rows if row.get("report_datetime") is not None and row.get("station")]
+    times = np.array([_epoch(row["report_datetime"]) for row in rows], dtype=np.int64)
+    return {
+        "station": np.array([row["station"].lower() for row in rows], dtype=str),
+        "time": times,
+        "issued": times.copy(),
+        "aqi": np.array([np.nan if row.get("aqi") is None else row["aqi"] for row in rows], dtype=np.float32),
+        "pm2_5": np.array([np.nan if row.get("pm2_5") is None else row["pm2_5"] for row in rows], dtype=np.float32),
+    }
+
+
+def forecast_columns(columns: Dict[str, Any], start_time: datetime, issued_at: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+    """
+    Archive columns for a format_columnar() forecast, whose first hour is at
+    start_time.
+    """
+    aqi = np.asarray(columns["aqi"], dtype=np.float32)
+    n_stations, hours = aqi.shape
+    times = np.tile(int(_epoch(start_time)) + 3600 * np.arange(hours, dtype=np.int64), n_stations)
+    return {
+        "station": np.repeat(np.array([name.lower() for name in columns["stations"]], dtype=str), hours),
+        "time": times,
+        "issued": np.full(len(times), _epoch(issued_at or datetime.now()), dtype=np.int64),
+        "aqi": aqi.reshape(-1),
+        "pm2_5": np.asarray(columns["pm2_5"], dtype=np.float32).reshape(-1),
+    }
+
+
+class HistoryArchive:
+    """
+    Append-only archive of observations and forecast runs.
+
+    Each batch is a compressed .npz segment of columns (station, time, issued,
+    aqi, pm2_5) under <root>/<kind>/<YYYY-MM-DD>/, the day it was written.
+    A SQLite index holds one row per (segment, station) with its time range,
+    so a query opens only the segments that hold the station in the range.
+    compact() merges a finished day's segments into one file.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._conn = ProcessLocalConnection(os.path.join(root, "index.sqlite3"), setup=self._create_schema)
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            "path TEXT NOT NULL, kind TEXT NOT NULL, day TEXT NOT NULL, station TEXT NOT NULL, "
+            "t_min INTEGER NOT NULL, t_max INTEGER NOT NULL, rows INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_segments_station_time ON segments (kind, station, t_max, t_min)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_segments_day ON segments (kind, day)")
+
+    def _connection(self) -> sqlite3.Connection:
+        return self._conn.get()
+
+    def _index_rows(self, path: str, kind: str, day: str, columns: Dict[str, np.ndarray]) -> List[Tuple]:
+        frame = pd.DataFrame({"station": columns["station"], "time": columns["time"]})
+        ranges = frame.groupby("station", sort=False)["time"].agg(["min", "max", "count"])
+        return [(path, kind, day, station, int(r["min"]), int(r["max"]), int(r["count"])) for station, r in ranges.iterrows()]
+
+    def append(self, kind: str, columns: Dict[str, np.ndarray], written_at: Optional[datetime] = None) -> Optional[str]:
+        """
+        Writes one batch as a new segment and indexes it; returns its path.
+        """
+        if kind not in HISTORY_KINDS:
+            raise ValueError(f"kind must be one of {HISTORY_KINDS}")
+        if len(columns["time"]) == 0:
+            return None
+        day = (written_at or datetime.now()).strftime("%Y-%m-%d")
+        directory = os.path.join(self.root, kind, day)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.time_ns()}.npz")
+        np.savez_compressed(path, **columns)
+        with self._lock:
+            conn = self._connection()
+            conn.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?)", self._index_rows(path, kind, day, columns))
+        logger.info("History segment written", extra={"kind": kind, "rows": len(columns["time"]), "path": path})
+        return path
+
+    def compact(self, kind: str, day: date) -> int:
+        """
+        Merges every segment written on day into a single one; returns the
+        number of segments merged.
+        """
+        day_str = day.strftime("%Y-%m-%d")
+        with self._lock:
+            conn = self._connection()
+            paths = [p for (p,) in conn.execute("SELECT DISTINCT path FROM segments WHERE kind = ? AND day = ?", (kind, day_str))]
+        if len(paths) < 2:
+            return 0
+        segments = [_load_segment(p, os.stat(p).st_mtime_ns) for p in paths]
+        columns = {name: np.concatenate([s[name] for s in segments]) for name in segments[0]}
+        order = np.lexsort((columns["time"], columns["station"]))
+        columns = {name: values[order] for name, values in columns.items()}
+
+        target = os.path.join(self.root, kind, day_str, COMPACTED_SEGMENT)
+        tmp = f"{target}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp, **columns)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Only the merged segments: a batch appended meanwhile keeps its own entry
+                conn.executemany("DELETE FROM segments WHERE path = ?", [(p,) for p in paths])
+                os.replace(tmp, target)
+                conn.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?)", self._index_rows(target, kind, day_str, columns))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        for path in paths:
+            if path != target:
+                os.remove(path)
+        logger.info("History day compacted", extra={"kind": kind, "day": day_str, "segments": len(paths), "rows": len(order)})
+        return len(paths)
+
+    def _segment_paths(self, kind: str, station: str, start: int, end: int) -> List[str]:
+        with self._lock:
+            conn = self._connection()
+            return [p for (p,) in conn.execute(
+                "SELECT DISTINCT path FROM segments WHERE kind = ? AND station = ? AND t_max >= ? AND t_min < ?",
+                (kind, station, start, end),
+            )]
+
+    def latest_times(self, kind: str, since: datetime) -> Dict[Tuple[str, str], datetime]:
+        """
+        {(station, variable): time of the newest row with a value for it} over
+        the segments holding rows at or after since.
+        """
+        with self._lock:
+            conn = self._connection()
+            paths = [p for (p,) in conn.execute("SELECT DISTINCT path FROM segments WHERE kind = ? AND t_max >= ?", (kind, _epoch(since)))]
+        latest: Dict[Tuple[str, str], int] = {}
+        for path in paths:
+            try:
+                segment = _load_segment(path, os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                continue  # Merged by a compaction; its rows are in the compacted segment
+            for variable in HISTORY_VARIABLES:
+                present = ~np.isnan(segment[variable])
+                frame = pd.DataFrame({"station": segment["station"][present], "time": segment["time"][present]})
+                for station, t in frame.groupby("station")["time"].max().items():
+                    latest[(station, variable)] = max(int(t), latest.get((station, variable), int(t)))
+        return {key: datetime.fromtimestamp(t, tz=timezone.utc) for key, t in latest.items()}
+
+    def read(self, kind: str, station: str, start: datetime, end: datetime) -> pd.DataFrame:
+        """
+        Rows for station with start <= time < end, oldest first. For forecasts,
+        only the latest run's value is kept for each hour.
+        """
+        station, t0, t1 = station.lower(), _epoch(start), _epoch(end)
+        for attempt in range(2):
+            try:
+                segments = [_load_segment(p, os.stat(p).st_mtime_ns) for p in self._segment_paths(kind, station, t0, t1)]
+                break
+            except FileNotFoundError:
+                # A compaction replaced the segments between the index lookup and the read
+                if attempt:
+                    raise
+        frames = []
+        for segment in segments:
+            mask = (segment["station"] == station) & (segment["time"] >= t0) & (segment["time"] < t1)
+            frames.append(pd.DataFrame({name: segment[name][mask] for name in ("time", "issued", *HISTORY_VARIABLES)}))
+        if not frames:
+            return pd.DataFrame(columns=["time", "issued", *HISTORY_VARIABLES])
+        frame = pd.concat(frames, ignore_index=True).sort_values(["time", "issued"], kind="stable")
+        if kind == "forecast":
+            frame = frame.drop_duplicates("time", keep="last")
+        return frame.reset_index(drop=True)
+
+    def query(self, kind: str, station: str, start: datetime, end: datetime, resolution: str = "raw", agg: str = "mean") -> List[Dict[str, Any]]:
+        """
+        The station's series between start and end, either raw or downsampled
+        to hourly/daily (local time) buckets with the given aggregate.
+        """
+        frame = self.read(kind, station, start, end)
+        zone = get_localzone()
+        times = pd.to_datetime(frame["time"].astype(np.int64), unit="s", utc=True).dt.tz_convert(zone)
+        if resolution != "raw":
+            buckets = times.dt.floor("h") if resolution == "hourly" else times.dt.floor("D", ambiguous=False, nonexistent="shift_backward")
+            values = frame[list(HISTORY_VARIABLES)].astype(np.float64).set_axis(pd.DatetimeIndex(buckets))
+            grouped = values.groupby(level=0, sort=True)
+            frame = grouped.agg(agg)
+            frame["count"] = grouped.size()
+            times = frame.index
+
+        series = []
+        for t, row in zip(times, frame.to_dict("records")):
+            item = {"time": t.isoformat()}
+            for name in HISTORY_VARIABLES:
+                value = row[name]
+                item[name] = None if pd.isna(value) else round(float(value), 2)
+            if "count" in row:
+                item["count"] = int(row["count"])
+            if kind == "forecast" and resolution == "raw":
+                item["issued_at"] = datetime.fromtimestamp(int(row["issued"]), tz=timezone.utc).astimezone(zone).isoformat()
+            series.append(item)
+        return series
+
+
+history_archive = HistoryArchive(os.getenv("HISTORY_ARCHIVE_PATH", "./history"))
@@ -0,0 +1,172 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import SQLModel
+
+from schema.air_quality_schema import AirQuality
+from service.history_service import HistoryArchive, observation_columns
+from service.real_time_snapshot_service import RealTimeSnapshot
+from util.logging_util import get_logger
+
+logger = get_logger("observation_ingest")
+
+AIR_QUALITY_COLUMNS = ("report_datetime", "station", "aqi", "pm2_5", "temp", "wind", "humidity")
+SEED_LOOKBACK = timedelta(days=2)  # How far back the archive is searched for the newest stored rows
+
+
+def _parse_report_datetime(value: Optional[str]) -> Optional[datetime]:
+    # RSS pubDate, e.g. "Wed, 25 Jun 2025 20:30:00 +0800"; the column stores aware datetimes (in UTC)
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def rows_from_snapshot(snapshot: RealTimeSnapshot) -> List[Dict[str, Any]]:
+    """
+    AirQuality rows for one poll: one per AQHI station (at the feed's report
+    time) and one per lamppost district with its mean PM2.5 (at the time the
+    lamppost feed was fetched, which stays the same while the feed is down).
+    """
+    rows = []
+    for item in snapshot.aqhi:
+        rows.append({
+            "report_datetime": _parse_report_datetime(item.get("report_datetime")),
+            "station": item.get("station"),
+            "aqi": item.get("aqi"),
+            "pm2_5": None,
+        })
+    polled_at = datetime.fromtimestamp(snapshot.particles_fetched_at, tz=timezone.utc).replace(microsecond=0)
+    for item in snapshot.particles:
+        if item.get("pm2_5") is None:
+            continue
+        rows.append({
+            "report_datetime": polled_at,
+            "station": item.get("station"),
+            "aqi": None,
+            "pm2_5": round(item["pm2_5"]),
+        })
+    return [{column: row.get(column) for column in AIR_QUALITY_COLUMNS} for row in rows]
+
+
+def _series_key(row: Dict[str, Any]) -> Tuple[str, str]:
+    # AQHI and lamppost rows for the same station name are separate series; the archive stores names lower-case
+    return (row["station"] or "").lower(), "lamppost" if row["aqi"] is None else "aqhi"
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Rows are written in UTC; a column without a time zone returns them naive
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+class ObservationIngestService:
+    """
+    Appends every real-time poll to the AirQuality table in bulk: COPY on
+    PostgreSQL (asyncpg), batched multi-row INSERTs elsewhere. With an
+    archive, the same rows are also written to the history archive. Rows no
+    newer than the last one stored for their station and feed are skipped, so
+    an unchanged feed is not stored again on every poll. The last stored times
+    are read from the table (or the archive without one) on the first ingest,
+    so this also holds across restarts and leader changes.
+    """
+
+    def __init__(self, engine: AsyncEngine, batch_size: int = 500, database_enabled: bool = True, archive: Optional[HistoryArchive] = None):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.database_enabled = database_enabled
+        self.archive = archive
+        self._last_written: Dict[Tuple[str, str], datetime] = {}  # {(station, feed): newest report_datetime written}
+        self._schema_ready = False
+        self._seeded = False
+        self.rows_written = 0
+
+    def _new_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        fresh = []
+        for row in rows:
+            key, reported = _series_key(row), row["report_datetime"]
+            if reported is None or (key in self._last_written and reported <= self._last_written[key]):
+                continue
+            fresh.append(row)
+        return fresh
+
+    def _mark_written(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            key = _series_key(row)
+            self._last_written[key] = max(row["report_datetime"], self._last_written.get(key, row["report_datetime"]))
+
+    async def _ensure_schema(self):
+        if not self._schema_ready:
+            async with self.engine.begin() as conn:
+                await conn.run_sync(SQLModel.metadata.create_all)
+            self._schema_ready = True
+
+    async def _stored_times(self) -> Dict[Tuple[str, str], datetime]:
+        latest: Dict[Tuple[str, str], datetime] = {}
+        if self.database_enabled:
+            await self._ensure_schema()
+            async with self.engine.connect() as conn:
+                for feed, condition in (("aqhi", AirQuality.aqi.is_not(None)), ("lamppost", AirQuality.aqi.is_(None))):
+                    result = await conn.execute(
+                        select(AirQuality.station, func.max(AirQuality.report_datetime))
+                        .where(condition, AirQuality.station.is_not(None), AirQuality.report_datetime.is_not(None))
+                        .group_by(AirQuality.station)
+                    )
+                    for station, reported in result:
+                        key = (station.lower(), feed)
+                        latest[key] = max(_as_utc(reported), latest.get(key, _as_utc(reported)))
+        elif self.archive is not None:
+            since = datetime.now(timezone.utc) - SEED_LOOKBACK
+            times = await asyncio.to_thread(self.archive.latest_times, "observation", since)
+            for (station, variable), reported in times.items():
+                latest[(station, "aqhi" if variable == "aqi" else "lamppost")] = reported
+        return latest
+
+    async def _seed(self):
+        for key, reported in (await self._stored_times()).items():
+            self._last_written[key] = max(reported, self._last_written.get(key, reported))
+        self._seeded = True
+        logger.info("Observation ingest seeded from stored rows", extra={"series": len(self._last_written)})
+
+    async def _copy(self, conn, rows: List[Dict[str, Any]]):
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            AirQuality.__tablename__,
+            records=[tuple(row[c] for c in AIR_QUALITY_COLUMNS) for row in rows],
+            columns=list(AIR_QUALITY_COLUMNS),
+        )
+
+    async def write_rows(self, rows: List[Dict[str, Any]]) -> int:
+        await self._ensure_schema()
+        async with self.engine.begin() as conn:
+            if conn.dialect.driver == "asyncpg":
+                # COPY runs on the driver connection and commits on its own
+                await self._copy(conn, rows)
+            else:
+                # executemany: SQLAlchemy renders each batch as one multi-row INSERT ... VALUES
+                for start in range(0, len(rows), self.batch_size):
+                    await conn.execute(insert(AirQuality), rows[start:start + self.batch_size])
+        return len(rows)
+
+    async def ingest(self, snapshot: RealTimeSnapshot) -> Tuple[int, int]:
+        """
+        Writes the snapshot's new rows; returns (rows written, rows skipped).
+        """
+        if not self._seeded:
+            await self._seed()
+        rows = rows_from_snapshot(snapshot)
+        fresh = self._new_rows(rows)
+        if fresh:
+            if self.database_enabled:
+                await self.write_rows(fresh)
+            if self.archive is not None:
+                await asyncio.to_thread(self.archive.append, "observation", observation_columns(fresh))
+            self._mark_written(fresh)
+            self.rows_written += len(fresh)
+        logger.info("Observations ingested", extra={"written": len(fresh), "skipped": len(rows) - len(fresh)})
+        return len(fresh), len(rows) - len(fresh)
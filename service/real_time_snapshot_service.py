@@ -0,0 +1,121 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from service.air_quality_service import AirQualityService
+from util.logging_util import get_logger
+
+logger = get_logger("real_time_snapshot")
+
+RETRY_SECONDS = 30  # Minimum gap between polls while a feed keeps failing
+
+
+@dataclass(frozen=True)
+class RealTimeSnapshot:
+    aqhi: List[Dict[str, Any]]
+    particles: List[Dict[str, Any]]
+    analysis: List[Dict[str, Any]]
+    aqhi_fetched_at: float  # time.time() when the AQHI data was fetched (an earlier poll's if this one failed)
+    particles_fetched_at: float  # The same for the lamppost data
+    polled_at: float  # time.time() when the feeds were last polled, successfully or not
+    aqhi_by_station: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # {lower-case station name: item}
+
+    @property
+    def fetched_at(self) -> float:
+        # The older feed decides how fresh the snapshot is
+        return min(self.aqhi_fetched_at, self.particles_fetched_at)
+
+    def age_seconds(self) -> int:
+        return max(0, int(time.time() - self.fetched_at))
+
+    def aqhi_for_station(self, station: Optional[str]) -> List[Dict[str, Any]]:
+        if station is None:
+            return self.aqhi
+        item = self.aqhi_by_station.get(station.lower())
+        return [item] if item is not None else []
+
+
+def _log_refresh_failure(task: asyncio.Task):
+    # Retrieving the exception also keeps asyncio from warning it was never awaited
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Real-time snapshot refresh failed", extra={"error": str(task.exception())})
+
+
+class RealTimeSnapshotService:
+    """
+    Keeps a precomputed snapshot of both real-time feeds (AQHI and lamppost
+    aggregates, plus their consolidated analysis join) that endpoints serve
+    immediately. A scheduler job refreshes it on an interval; if a request finds
+    it older than max_age_seconds it is still served and a background refresh
+    is started (stale-while-revalidate). Only a cold start waits for upstream.
+    """
+
+    def __init__(self, air_quality_service: AirQualityService, max_age_seconds: float):
+        self.air_quality_service = air_quality_service
+        self.max_age_seconds = max_age_seconds
+        self._snapshot: Optional[RealTimeSnapshot] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def _build(self, session) -> RealTimeSnapshot:
+        previous = self._snapshot
+        aqhi, particles = await asyncio.gather(
+            self.air_quality_service.get_real_time_air_quality(session),
+            self.air_quality_service.get_real_time_air_quality_particle(session),
+            return_exceptions=True,
+        )
+        now = time.time()
+        aqhi_fetched_at = particles_fetched_at = now
+        # Keep the last good copy of a feed that failed this round, with the time it was fetched
+        if isinstance(aqhi, Exception):
+            if previous is None:
+                raise aqhi
+            logger.warning("AQHI refresh failed, keeping previous data", extra={"error": str(aqhi)})
+            aqhi, aqhi_fetched_at = previous.aqhi, previous.aqhi_fetched_at
+        if isinstance(particles, Exception):
+            if previous is None:
+                raise particles
+            logger.warning("Lamppost refresh failed, keeping previous data", extra={"error": str(particles)})
+            particles, particles_fetched_at = previous.particles, previous.particles_fetched_at
+        return RealTimeSnapshot(
+            aqhi=aqhi,
+            particles=particles,
+            analysis=self.air_quality_service.consolidate_analysis(aqhi, particles),
+            aqhi_fetched_at=aqhi_fetched_at,
+            particles_fetched_at=particles_fetched_at,
+            polled_at=now,
+            aqhi_by_station={item['station'].lower(): item for item in aqhi},
+        )
+
+    async def _run_refresh(self, session):
+        try:
+            self._snapshot = await self._build(session)
+            return self._snapshot
+        finally:
+            self._refresh_task = None
+
+    def _start_refresh(self, session) -> asyncio.Task:
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._run_refresh(session))
+            self._refresh_task.add_done_callback(_log_refresh_failure)
+        return self._refresh_task
+
+    async def refresh(self, session=None) -> RealTimeSnapshot:
+        """
+        Polls both feeds now, joining a refresh that is already running.
+        """
+        return await asyncio.shield(self._start_refresh(session))
+
+    async def get_snapshot(self, session=None) -> RealTimeSnapshot:
+        """
+        Returns the current snapshot, starting a background refresh when it is stale.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return await self.refresh(session)
+        now = time.time()
+        # While a feed is down its data stays stale; retry it at most every RETRY_SECONDS
+        if now - snapshot.fetched_at > self.max_age_seconds and now - snapshot.polled_at > RETRY_SECONDS:
+            # The request's session may close before a background refresh ends
+            self._start_refresh(None)
+        return snapshot
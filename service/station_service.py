@@ -1,28 +1,136 @@
 from sqlmodel import select
 from schema.station_schema import Station
 from model.station_model import StationModel
-from typing import List
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import math
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+STATIONS_CSV = os.path.join(os.path.dirname(__file__), "..", "lib", "stations_epd_idx.csv")
+EARTH_RADIUS_KM = 6371.0088
+
+raw_data = [{"id":1,"name":"Causeway Bay","latitude":22.2798,"longitude":114.1831},
+            {"id":2,"name":"Central","latitude":22.2823,"longitude":114.1585},
+            {"id":3,"name":"Central/Western","latitude":22.2866,"longitude":114.1455},
+            {"id":5,"name":"Kwai Chung","latitude":22.3639,"longitude":114.1347},
+            {"id":6,"name":"Kwun Tong","latitude":22.3122,"longitude":114.2255},
+            {"id":7,"name":"Mong Kok","latitude":22.3193,"longitude":114.1694},
+            {"id":8,"name":"North","latitude":22.5027,"longitude":114.1308},
+            {"id":9,"name":"Southern","latitude":22.2477,"longitude":114.1584},
+            {"id":10,"name":"Sham Shui Po","latitude":22.3307,"longitude":114.1622},
+            {"id":11,"name":"Shatin","latitude":22.3823,"longitude":114.1892},
+            {"id":12,"name":"Tung Chung","latitude":22.2887,"longitude":113.9424},
+            {"id":13,"name":"Tseung Kwan O","latitude":22.3079,"longitude":114.2601},
+            {"id":14,"name":"Tap Mun","latitude":22.4633,"longitude":114.3617},
+            {"id":15,"name":"Tuen Mun","latitude":22.3916,"longitude":113.9736},
+            {"id":16,"name":"Tai Po","latitude":22.448,"longitude":114.1612},
+            {"id":17,"name":"Tsuen Wan","latitude":22.3709,"longitude":114.1135},
+            {"id":18,"name":"Yuen Long","latitude":22.4455,"longitude":114.0226}]
+
+
+@dataclass(frozen=True, slots=True)
+class StationRecord:
+    id: int
+    name: str
+    latitude: float
+    longitude: float
+    station_code: Optional[str] = None
+    lat_idx: Optional[int] = None
+    lon_idx: Optional[int] = None
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class StationCatalog:
+    """
+    Immutable station records built once, with lookups by lower-case name,
+    station_code and model grid cell, and a KD-tree for nearest-station queries.
+    """
+
+    def __init__(self, records: List[StationRecord]):
+        self.records: Tuple[StationRecord, ...] = tuple(records)
+        self.models: List[StationModel] = [
+            StationModel(id=r.id, name=r.name, latitude=r.latitude, longitude=r.longitude) for r in self.records
+        ]
+        self.by_name: Dict[str, StationRecord] = {r.name.lower(): r for r in self.records}
+        self.by_code: Dict[str, StationRecord] = {r.station_code: r for r in self.records if r.station_code}
+        self.by_grid: Dict[Tuple[int, int], StationRecord] = {
+            (r.lat_idx, r.lon_idx): r for r in self.records if r.lat_idx is not None
+        }
+        # Equirectangular projection around the catalog's mean latitude; at Hong Kong
+        # scale the ordering matches great-circle distance
+        self._lon_scale = math.cos(math.radians(np.mean([r.latitude for r in self.records]))) if self.records else 1.0
+        self._tree = cKDTree([self._project(r.latitude, r.longitude) for r in self.records]) if self.records else None
+
+    @classmethod
+    def from_csv(cls, stations: List[dict] = raw_data, csv_path: str = STATIONS_CSV) -> "StationCatalog":
+        """
+        Joins the API station list with the EPD station codes and grid cells by name.
+        """
+        grid = pd.read_csv(csv_path)
+        grid_by_name = {row.station.lower(): row for row in grid.itertuples(index=False)}
+        records = []
+        for data in stations:
+            row = grid_by_name.get(data["name"].lower())
+            records.append(StationRecord(
+                id=data["id"],
+                name=data["name"],
+                latitude=data["latitude"],
+                longitude=data["longitude"],
+                station_code=row.station_code if row is not None else None,
+                lat_idx=int(row.lat_idx) if row is not None else None,
+                lon_idx=int(row.lon_idx) if row is not None else None,
+            ))
+        return cls(records)
+
+    def _project(self, latitude: float, longitude: float) -> Tuple[float, float]:
+        return (latitude, longitude * self._lon_scale)
+
+    def get_by_name(self, name: str) -> Optional[StationRecord]:
+        return self.by_name.get(name.lower())
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> List[Tuple[StationRecord, float]]:
+        """
+        Returns the k stations closest to (latitude, longitude) with their distance in km.
+        """
+        if self._tree is None:
+            return []
+        k = min(k, len(self.records))
+        _, indices = self._tree.query(self._project(latitude, longitude), k=k)
+        indices = np.atleast_1d(indices)
+        return [
+            (self.records[i], haversine_km(latitude, longitude, self.records[i].latitude, self.records[i].longitude))
+            for i in indices
+        ]
+
+
+station_catalog = StationCatalog.from_csv()
+
 
 class StationService:
-    async def get_stations(self, session): 
-        raw_data = [{"id":1,"name":"Causeway Bay","latitude":22.2798,"longitude":114.1831},
-                    {"id":2,"name":"Central","latitude":22.2823,"longitude":114.1585},
-                    {"id":3,"name":"Central/Western","latitude":22.2866,"longitude":114.1455},
-                    {"id":5,"name":"Kwai Chung","latitude":22.3639,"longitude":114.1347},
-                    {"id":6,"name":"Kwun Tong","latitude":22.3122,"longitude":114.2255},
-                    {"id":7,"name":"Mong Kok","latitude":22.3193,"longitude":114.1694},
-                    {"id":8,"name":"North","latitude":22.5027,"longitude":114.1308},
-                    {"id":9,"name":"Southern","latitude":22.2477,"longitude":114.1584},
-                    {"id":10,"name":"Sham Shui Po","latitude":22.3307,"longitude":114.1622},
-                    {"id":11,"name":"Shatin","latitude":22.3823,"longitude":114.1892},
-                    {"id":12,"name":"Tung Chung","latitude":22.2887,"longitude":113.9424},
-                    {"id":13,"name":"Tseung Kwan O","latitude":22.3079,"longitude":114.2601},
-                    {"id":14,"name":"Tap Mun","latitude":22.4633,"longitude":114.3617},
-                    {"id":15,"name":"Tuen Mun","latitude":22.3916,"longitude":113.9736},
-                    {"id":16,"name":"Tai Po","latitude":22.448,"longitude":114.1612},
-                    {"id":17,"name":"Tsuen Wan","latitude":22.3709,"longitude":114.1135},
-                    {"id":18,"name":"Yuen Long","latitude":22.4455,"longitude":114.0226}]
-        return [StationModel(**data) for data in raw_data]            
+    async def get_stations(self, session):
+        return station_catalog.models
         # statement = select(Station)
-        # results = session.exec(statement)
+        # results = await session.exec(statement)
         # return [StationModel(id=r.id, name=r.name, latitude=r.latitude or 0.0, longitude=r.longitude or 0.0).model_dump() for r in results]
+
+    def get_nearest_stations(self, latitude: float, longitude: float, limit: int = 1) -> List[dict]:
+        return [
+            {
+                "id": record.id,
+                "name": record.name,
+                "latitude": record.latitude,
+                "longitude": record.longitude,
+                "station_code": record.station_code,
+                "distance_km": round(distance, 3),
+            }
+            for record, distance in station_catalog.nearest(latitude, longitude, k=limit)
+        ]
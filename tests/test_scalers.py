@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+from lib.prediction import (
+    AQI_SCALERS_PATH,
+    FSP_SCALERS_PATH,
+    apply_compiled_scaler,
+    compile_channel_scalers,
+    compile_patch_scaler,
+    load_scalers,
+    scaler_parity_error,
+    transform_with_channel_scalers,
+    transform_with_scalers,
+)
+
+TOLERANCE = 1e-4
+SCALER_TYPES = [StandardScaler, MinMaxScaler]
+
+
+def _patches(rng, channels: int, patch_size: int, loc: np.ndarray, spread: np.ndarray) -> np.ndarray:
+    # (T, C, S, H, W) patches around the given per-channel (or per-feature) location and spread
+    shape = (2, channels, 3, patch_size, patch_size)
+    return (loc + spread * rng.standard_normal(shape)).astype(np.float32)
+
+
+def _fitted_channel_scalers(scaler_type, rng, channels=16):
+    return [scaler_type().fit(rng.normal(c, 1.0 + c, size=(200, 1))) for c in range(channels)]
+
+
+def _fitted_patch_scaler(scaler_type, rng, features=15 * 15 * 15):
+    return scaler_type().fit(rng.normal(np.linspace(-5, 5, features), np.linspace(0.5, 3, features), size=(50, features)))
+
+
+@pytest.mark.parametrize("scaler_type", SCALER_TYPES)
+def test_channel_scalers_match_sklearn(scaler_type):
+    rng = np.random.default_rng(0)
+    scalers = _fitted_channel_scalers(scaler_type, rng)
+    X = _patches(rng, len(scalers), 3, np.arange(16).reshape(1, -1, 1, 1, 1), 2.0)
+    compiled = compile_channel_scalers(scalers)
+    assert scaler_parity_error(transform_with_channel_scalers(X, scalers), apply_compiled_scaler(X, compiled)) < TOLERANCE
+
+
+@pytest.mark.parametrize("scaler_type", SCALER_TYPES)
+def test_patch_scaler_matches_sklearn(scaler_type):
+    rng = np.random.default_rng(0)
+    scaler = _fitted_patch_scaler(scaler_type, rng)
+    X = _patches(rng, 15, 15, 0.0, 3.0)
+    compiled = compile_patch_scaler(scaler)
+    assert scaler_parity_error(transform_with_scalers(X, scaler), apply_compiled_scaler(X, compiled)) < TOLERANCE
+
+
+def test_compiled_scaler_applies_in_place():
+    rng = np.random.default_rng(0)
+    scalers = _fitted_channel_scalers(StandardScaler, rng)
+    X = _patches(rng, len(scalers), 3, 0.0, 1.0)
+    expected = transform_with_channel_scalers(X, scalers)
+    out = apply_compiled_scaler(X, compile_channel_scalers(scalers), out=X)
+    assert out is X
+    assert scaler_parity_error(expected, out) < TOLERANCE
+
+
+@pytest.mark.skipif(not (os.path.exists(AQI_SCALERS_PATH) and os.path.exists(FSP_SCALERS_PATH)), reason="scaler files not available")
+def test_shipped_scalers_match_sklearn():
+    rng = np.random.default_rng(0)
+    aqi_scalers, fsp_scaler = load_scalers(AQI_SCALERS_PATH), load_scalers(FSP_SCALERS_PATH)
+    aqi_compiled, fsp_compiled = compile_channel_scalers(aqi_scalers), compile_patch_scaler(fsp_scaler)
+    # Inputs around the range each compiled scaler maps to [-1, 1]: x = (y - offset) / scale
+    X_aqi = _patches(rng, len(aqi_scalers), 3, -aqi_compiled.offset / aqi_compiled.scale, 1.0 / np.abs(aqi_compiled.scale))
+    X_fsp = _patches(rng, 15, 15, -fsp_compiled.offset / fsp_compiled.scale, 1.0 / np.abs(fsp_compiled.scale))
+    assert scaler_parity_error(transform_with_channel_scalers(X_aqi, aqi_scalers), apply_compiled_scaler(X_aqi, aqi_compiled)) < TOLERANCE
+    assert scaler_parity_error(transform_with_scalers(X_fsp, fsp_scaler), apply_compiled_scaler(X_fsp, fsp_compiled)) < TOLERANCE
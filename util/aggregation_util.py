@@ -0,0 +1,38 @@
+import math
+from typing import Any, Dict, List, Sequence
+
+import pandas as pd
+
+
+def describe_by_group(frame: pd.DataFrame, key: str, columns: Sequence[str], percentiles: Sequence[int] = (10, 50, 90)) -> List[Dict[str, Any]]:
+    """
+    Per-group count, mean, min, max and percentiles of each column in one
+    vectorized groupby. Missing values (NaN) are skipped column by column, so
+    every column has its own count. Groups keep their order of first appearance.
+    """
+    if frame.empty:
+        return []
+    grouped = frame.groupby(key, sort=False)[list(columns)]
+    stats = grouped.agg(["count", "mean", "min", "max"])
+    quantiles = grouped.quantile([p / 100 for p in percentiles]).unstack()
+
+    results = []
+    for group in stats.index:
+        row = stats.loc[group]
+        quantile_row = quantiles.loc[group]
+        distribution = {}
+        for column in columns:
+            count = int(row[(column, "count")])
+            summary = {"count": count}
+            for stat in ("mean", "min", "max"):
+                summary[stat] = _to_float(row[(column, stat)]) if count else None
+            for p in percentiles:
+                summary[f"p{p}"] = _to_float(quantile_row[(column, p / 100)]) if count else None
+            distribution[column] = summary
+        results.append({key: group, "distribution": distribution})
+    return results
+
+
+def _to_float(value) -> Any:
+    value = float(value)
+    return None if math.isnan(value) else value
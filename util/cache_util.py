@@ -1,65 +1,323 @@
-from datetime import datetime, timedelta
-from typing import Any, Dict, Tuple, Optional
+import asyncio
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Tuple, Optional
+
+from util.logging_util import get_logger
+from util.metrics_util import CACHE_EVENTS
+from util.sqlite_util import ProcessLocalConnection
+
+logger = get_logger("cache")
+
+
+def _format_timestamp(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class CacheBackend(ABC):
+    """
+    Storage used by InMemoryCache. Entries are (value, expiration) pairs, with
+    the expiration measured on the backend's `clock`. `shared` tells callers
+    whether other processes see the same entries.
+    """
+    shared = False
+    clock: Callable[[], float] = staticmethod(time.time)
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, expires_at: float) -> int:
+        """
+        Stores the entry and returns how many other entries were evicted to make room.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def sweep(self, now: float) -> int:
+        """
+        Removes every entry that expired before now; returns how many were removed.
+        """
+
+    @abstractmethod
+    def expirations(self) -> Dict[str, float]:
+        ...
+
+
+class DictCacheBackend(CacheBackend):
+    """
+    Per-process LRU storage bounded to max_entries, with expirations on
+    time.monotonic() so wall-clock changes cannot expire or revive entries.
+
+    Reads take no lock (dict lookups and OrderedDict.move_to_end are atomic
+    under the GIL); writes, evictions and sweeps are serialized by a lock.
+    """
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict() # {key: (value, expiration)}, oldest use first
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        entry = self._cache.get(key)
+        if entry is not None:
+            try:
+                self._cache.move_to_end(key)
+            except KeyError:
+                pass # Deleted by another thread in between; the entry we read is still valid to return
+        return entry
+
+    def set(self, key: str, value: Any, expires_at: float) -> int:
+        evicted = 0
+        with self._lock:
+            self._cache[key] = (value, expires_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def sweep(self, now: float) -> int:
+        with self._lock:
+            expired = [k for k, (_, expires_at) in self._cache.items() if expires_at <= now]
+            for k in expired:
+                del self._cache[k]
+        return len(expired)
+
+    def expirations(self) -> Dict[str, float]:
+        return {k: v[1] for k, v in list(self._cache.items())}
+
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    File-backed storage shared by every worker process on the host.
+    Values are pickled into a single SQLite table in WAL mode, so one worker
+    can publish a forecast that the others read without recomputing it.
+    Expirations are UNIX timestamps so they are comparable across processes.
+    """
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = ProcessLocalConnection(path, setup=self._create_schema)
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        return self._conn.get()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._connection().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float) -> int:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, blob, expires_at)
+            )
+        return 0
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._connection().execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM cache")
+
+    def sweep(self, now: float) -> int:
+        with self._lock:
+            return self._connection().execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+
+    def expirations(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._connection().execute("SELECT key, expires_at FROM cache").fetchall())
+
+
+def create_cache_backend(name: Optional[str] = None) -> CacheBackend:
+    """
+    Builds the backend selected by CACHE_BACKEND ("memory" or "sqlite").
+    The memory backend holds at most CACHE_MAX_ENTRIES entries.
+    """
+    name = (name or os.getenv("CACHE_BACKEND", "memory")).lower()
+    if name == "memory":
+        return DictCacheBackend(max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")))
+    if name == "sqlite":
+        return SqliteCacheBackend(os.getenv("CACHE_SQLITE_PATH", "/tmp/aqf_cache.sqlite3"))
+    raise ValueError(f"Unknown CACHE_BACKEND '{name}'. Expected 'memory' or 'sqlite'.")
+
 
 class InMemoryCache:
-    def __init__(self, default_ttl_seconds: int = 3600): # Default to 1 hour
-        self._cache: Dict[str, Tuple[Any, datetime]] = {} # {key: (value, expiration_datetime)}
+    """
+    TTL cache over a CacheBackend, with per-key TTLs, optional expiry jitter,
+    a sweep() for a periodic background job, single-flight get_or_compute()
+    and hit/miss statistics. Statistics are plain counters and may undercount
+    slightly under heavy thread contention.
+    """
+
+    def __init__(self, default_ttl_seconds: int = 3600, backend: Optional[CacheBackend] = None): # Default to 1 hour
+        self.backend = backend or DictCacheBackend()
         self.default_ttl_seconds = default_ttl_seconds
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.computes = 0
+        self.coalesced = 0
 
-    def set(self, key: str, value: Any, ttl_seconds: Optional[int] = None):
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None, jitter: float = 0.0):
         """
         Stores a value in the cache with an optional TTL.
-        If ttl_seconds is None, uses the default_ttl_seconds.
+        If ttl_seconds is None, uses the default_ttl_seconds. A jitter of e.g. 0.1
+        shortens the TTL by a random 0-10% so keys set together expire apart.
         """
         if ttl_seconds is None:
             ttl_seconds = self.default_ttl_seconds
-            
-        expiration_time = datetime.now() + timedelta(seconds=ttl_seconds)
-        self._cache[key] = (value, expiration_time)
-        print(f"Cache: Set '{key}', expires at {expiration_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        if jitter:
+            ttl_seconds *= 1.0 - random.uniform(0.0, jitter)
+
+        evicted = self.backend.set(key, value, self.backend.clock() + ttl_seconds)
+        if evicted:
+            self.evictions += evicted
+            CACHE_EVENTS.labels("eviction").inc(evicted)
+        logger.info("Cache set", extra={"key": key, "ttl_seconds": round(ttl_seconds, 1)})
 
     def get(self, key: str) -> Optional[Any]:
         """
         Retrieves a value from the cache. Returns None if key not found or expired.
-        Automatically cleans up expired items on access.
+        Expired items are removed on access as well as by sweep().
         """
-        if key not in self._cache:
-            print(f"Cache: '{key}' not found.")
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            CACHE_EVENTS.labels("miss").inc()
+            logger.debug("Cache miss", extra={"key": key, "sampled": True})
             return None
 
-        value, expiration_time = self._cache[key]
-        
-        if datetime.now() < expiration_time:
-            print(f"Cache: Hit for '{key}'. Valid until {expiration_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        value, expiration_time = entry
+
+        if self.backend.clock() < expiration_time:
+            self.hits += 1
+            CACHE_EVENTS.labels("hit").inc()
+            logger.debug("Cache hit", extra={"key": key, "sampled": True})
             return value
         else:
-            print(f"Cache: '{key}' found but expired. Expired at {expiration_time.strftime('%Y-%m-%d %H:%M:%S')}. Removing.")
-            del self._cache[key] # Remove expired item
+            self.expired += 1
+            CACHE_EVENTS.labels("expired").inc()
+            logger.debug("Cache entry expired, removing", extra={"key": key})
+            self.backend.delete(key) # Remove expired item
             return None
 
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl_seconds: Optional[float] = None, jitter: float = 0.1) -> Any:
+        """
+        Returns the cached value for key, or awaits compute() and caches its
+        result. Concurrent misses for the same key share one compute() call
+        (stampede protection within this process), and the TTL is jittered.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._compute_and_set(key, compute, ttl_seconds, jitter))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shielded so one cancelled caller does not cancel the computation for the others
+        return await asyncio.shield(future)
+
+    async def _compute_and_set(self, key: str, compute: Callable[[], Awaitable[Any]], ttl_seconds: Optional[float], jitter: float) -> Any:
+        self.computes += 1
+        value = await compute()
+        self.set(key, value, ttl_seconds, jitter)
+        return value
+
     def invalidate(self, key: str):
         """
         Manually invalidates/removes a specific key from the cache.
         """
-        if key in self._cache:
-            del self._cache[key]
-            print(f"Cache: Manually invalidated '{key}'.")
+        if self.backend.delete(key):
+            logger.info("Cache invalidated", extra={"key": key})
         else:
-            print(f"Cache: '{key}' not found for invalidation.")
+            logger.debug("Cache key not found for invalidation", extra={"key": key})
 
     def clear_all(self):
         """
         Clears all entries from the cache.
         """
-        self._cache.clear()
-        print("Cache: All entries cleared.")
+        self.backend.clear()
+        logger.info("Cache cleared")
+
+    def sweep(self) -> int:
+        """
+        Removes every expired entry; returns how many were removed.
+        """
+        removed = self.backend.sweep(self.backend.clock())
+        if removed:
+            self.expired += removed
+            CACHE_EVENTS.labels("expired").inc(removed)
+            logger.info("Cache swept expired entries", extra={"removed": removed})
+        return removed
 
     def get_status(self):
         """
-        Returns the current number of items in the cache and their keys.
+        Returns the current number of items in the cache, their keys and expiry
+        times, and hit/miss/eviction statistics.
         """
+        expirations = self.backend.expirations()
+        # Convert backend clock readings (monotonic for the memory backend) to wall time
+        offset = time.time() - self.backend.clock()
+        lookups = self.hits + self.misses + self.expired
         return {
-            "count": len(self._cache),
-            "keys": list(self._cache.keys()),
-            "details": {k: v[1].strftime('%Y-%m-%d %H:%M:%S') for k, v in self._cache.items()}
-        }
\ No newline at end of file
+            "backend": type(self.backend).__name__,
+            "count": len(expirations),
+            "max_entries": getattr(self.backend, "max_entries", None),
+            "keys": list(expirations.keys()),
+            "details": {k: _format_timestamp(v + offset) for k, v in expirations.items()},
+            "stats": {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "computes": self.computes,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._inflight),
+            },
+        }
@@ -0,0 +1,100 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class InferenceExecutor:
+    """
+    Runs blocking, CPU-bound work (model inference) on a bounded thread pool so
+    it never blocks the event loop. Concurrent calls sharing a key are coalesced
+    onto the single in-flight computation (single-flight).
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()  # Counters below are updated from worker threads
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._coalesced = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._total_run_seconds = 0.0
+
+    def _run_timed(self, submitted_at: float, fn: Callable[..., Any], *args) -> Any:
+        started_at = time.monotonic()
+        wait_seconds = started_at - submitted_at
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._total_wait_seconds += wait_seconds
+            self._max_wait_seconds = max(self._max_wait_seconds, wait_seconds)
+        try:
+            result = fn(*args)
+            with self._lock:
+                self._completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._total_run_seconds += time.monotonic() - started_at
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    async def run(self, key: str, fn: Callable[..., Any], *args) -> Any:
+        """
+        Runs fn(*args) on the pool, or joins the in-flight run for the same key.
+        """
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self._coalesced += 1
+            return await asyncio.shield(in_flight)
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._queued += 1
+            self._submitted += 1
+        future = loop.run_in_executor(self._executor, self._run_timed, time.monotonic(), fn, *args)
+        self._in_flight[key] = future
+        # Clear the key when the work finishes, not when the first caller goes away
+        future.add_done_callback(functools.partial(self._forget, key))
+        # Shield so a cancelled request doesn't cancel the run other callers await
+        return await asyncio.shield(future)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns pool size, queue depth and wait/run time metrics.
+        """
+        with self._lock:
+            started = self._completed + self._failed + self._running
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "in_flight_keys": list(self._in_flight.keys()),
+                "submitted": self._submitted,
+                "coalesced": self._coalesced,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_seconds": round(self._total_wait_seconds / started, 4) if started else 0.0,
+                "max_wait_seconds": round(self._max_wait_seconds, 4),
+                "avg_run_seconds": round(self._total_run_seconds / (self._completed + self._failed), 4)
+                if (self._completed + self._failed)
+                else 0.0,
+            }
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from util.metrics_util import UPSTREAM_FETCH_SECONDS, span
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+@dataclass
+class _UpstreamEntry:
+    value: Any
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float  # time.monotonic()
+
+
+class UpstreamClient:
+    """
+    One application-lifetime httpx.AsyncClient (pooled keep-alive connections,
+    HTTP/2 when available) with a short-TTL cache of parsed upstream payloads.
+
+    Within the TTL a URL is served from memory; after it, the refresh is a
+    conditional request (If-None-Match / If-Modified-Since) so an unchanged feed
+    costs a 304. Concurrent refreshes of the same URL share one upstream fetch.
+    """
+
+    def __init__(self, timeout: float = 10.0, ttl_seconds: float = 60.0, max_connections: int = 20):
+        self.timeout = timeout
+        self.ttl_seconds = ttl_seconds
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self._entries: Dict[str, _UpstreamEntry] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.upstream_fetches = 0
+        self.not_modified = 0
+        self.cache_hits = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=self.max_connections, keepalive_expiry=60.0),
+            )
+        return self._client
+
+    def _is_fresh(self, entry: Optional[_UpstreamEntry], ttl_seconds: float) -> bool:
+        return entry is not None and time.monotonic() - entry.fetched_at < ttl_seconds
+
+    async def fetch(self, url: str, parse: Callable[[httpx.Response], Awaitable[Any]], ttl_seconds: Optional[float] = None) -> Any:
+        """
+        Returns parse(response) for url, reusing the cached result while it is
+        fresh or while upstream answers 304 Not Modified. parse receives the
+        open streaming response and must read the body itself.
+        """
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        entry = self._entries.get(url)
+        if self._is_fresh(entry, ttl_seconds):
+            self.cache_hits += 1
+            return entry.value
+
+        lock = self._locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            # Another request may have refreshed it while we waited
+            entry = self._entries.get(url)
+            if self._is_fresh(entry, ttl_seconds):
+                self.cache_hits += 1
+                return entry.value
+
+            headers = {}
+            if entry is not None and entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry is not None and entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+            self.upstream_fetches += 1
+            host = urlsplit(url).netloc
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                with span("upstream.fetch", url=url):
+                    async with self._get_client().stream("GET", url, headers=headers) as response:
+                        if response.status_code == 304 and entry is not None:
+                            self.not_modified += 1
+                            outcome = "not_modified"
+                            entry.fetched_at = time.monotonic()
+                            return entry.value
+                        if response.is_error:
+                            await response.aread() # So error handlers can use response.text
+                            response.raise_for_status()
+                        value = await parse(response)
+                        outcome = "fetched"
+                        self._entries[url] = _UpstreamEntry(
+                            value=value,
+                            etag=response.headers.get("etag"),
+                            last_modified=response.headers.get("last-modified"),
+                            fetched_at=time.monotonic(),
+                        )
+                return value
+            finally:
+                # Includes streaming the body through parse, i.e. the full fetch
+                UPSTREAM_FETCH_SECONDS.labels(host, outcome).observe(time.perf_counter() - start)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._locks.clear() # Locks are bound to the event loop that is shutting down
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "ttl_seconds": self.ttl_seconds,
+            "cached_urls": list(self._entries.keys()),
+            "upstream_fetches": self.upstream_fetches,
+            "not_modified": self.not_modified,
+            "cache_hits": self.cache_hits,
+        }
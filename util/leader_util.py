@@ -0,0 +1,52 @@
+import os
+from typing import Optional
+
+from util.logging_util import get_logger
+
+logger = get_logger("leader")
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, and no multi-worker gunicorn either
+    fcntl = None
+
+
+class LeaderElection:
+    """
+    Elects a single leader among the worker processes on a host using an
+    exclusive, non-blocking flock on a shared lock file. The lock is held for
+    the life of the leader process and released by the OS if it dies, so a
+    follower calling try_acquire() later takes over.
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._fd: Optional[int] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return fcntl is None or self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """
+        Attempts to become leader. Returns True if this process is (now) the leader.
+        """
+        if self.is_leader:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        logger.info("Process is now leader", extra={"pid": os.getpid()})
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import random
+import sys
+from typing import Optional
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sampled"}
+_configured = False
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line (json) or as the message
+    followed by key=value pairs (text), including fields passed via extra=.
+    """
+
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = _extra_fields(record)
+        if self.fmt == "json":
+            payload = {
+                "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                payload["exception"] = self.formatException(record.exc_info)
+            return json.dumps(payload, default=str)
+        line = f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through only a fraction of the records logged with extra={"sampled": True}
+    (hot-path events such as cache hits); every other record passes.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sampled", False):
+            return random.random() < self.rate
+        return True
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None, sample_rate: Optional[float] = None):
+    """
+    Sets up the service's log handler once, from LOG_LEVEL (INFO), LOG_FORMAT
+    (text or json) and LOG_SAMPLE_RATE (0.01) unless given explicitly.
+    """
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(StructuredFormatter((fmt or os.getenv("LOG_FORMAT", "text")).lower()))
+    handler.addFilter(SamplingFilter(float(sample_rate if sample_rate is not None else os.getenv("LOG_SAMPLE_RATE", "0.01"))))
+    logger = logging.getLogger("aqf")
+    logger.addHandler(handler)
+    logger.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    logger.propagate = False
+    _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"aqf.{name}")
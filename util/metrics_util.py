@@ -0,0 +1,145 @@
+import contextlib
+import functools
+import os
+import time
+from typing import Any, Callable, Dict
+
+from util.logging_util import get_logger
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+    from prometheus_client import multiprocess
+    PROMETHEUS_AVAILABLE = True
+except ImportError:  # Metrics become no-ops without prometheus_client
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+try:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer("hku-air-quality-forecasting-api")
+except ImportError:  # Spans are optional; without an SDK configured they are no-ops anyway
+    _tracer = None
+
+logger = get_logger("metrics")
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+
+def _histogram(name: str, documentation: str, labels: tuple, **kwargs):
+    return Histogram(name, documentation, labels, **kwargs) if PROMETHEUS_AVAILABLE else _NoopMetric()
+
+
+def _counter(name: str, documentation: str, labels: tuple):
+    return Counter(name, documentation, labels) if PROMETHEUS_AVAILABLE else _NoopMetric()
+
+
+REQUEST_LATENCY = _histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+CACHE_EVENTS = _counter("cache_events_total", "InMemoryCache lookups by outcome (hit, miss, expired) and LRU evictions", ("event",))
+FORECAST_STAGE_SECONDS = _histogram(
+    "forecast_stage_duration_seconds", "Duration of each forecast pipeline stage", ("stage",), buckets=STAGE_BUCKETS
+)
+UPSTREAM_FETCH_SECONDS = _histogram(
+    "upstream_fetch_duration_seconds", "Duration of upstream EPD feed requests", ("host", "outcome"), buckets=STAGE_BUCKETS
+)
+JOB_SECONDS = _histogram(
+    "scheduler_job_duration_seconds", "Scheduler job run time by outcome", ("job", "outcome"), buckets=STAGE_BUCKETS
+)
+
+
+def span(name: str, **attributes):
+    """
+    An OpenTelemetry span when opentelemetry is installed, otherwise a no-op.
+    """
+    if _tracer is None:
+        return contextlib.nullcontext()
+    return _tracer.start_as_current_span(name, attributes=attributes or None)
+
+
+@contextlib.contextmanager
+def observe_stage(stage: str):
+    """
+    Times a forecast stage into forecast_stage_duration_seconds, inside a span.
+    """
+    start = time.perf_counter()
+    with span(f"forecast.{stage}"):
+        try:
+            yield
+        finally:
+            FORECAST_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def instrument_job(name: str) -> Callable:
+    """
+    Wraps an async scheduler job: records its run time and outcome and logs
+    (rather than raises) a failure, so one failed run does not stop later ones.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "success"
+            try:
+                with span(f"job.{name}"):
+                    return await fn(*args, **kwargs)
+            except Exception:
+                outcome = "error"
+                logger.exception("Scheduler job failed", extra={"job": name})
+            finally:
+                JOB_SECONDS.labels(name, outcome).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route template (e.g.
+    /api/stations/nearest), so path parameters do not explode label cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    Prometheus exposition of this process's metrics, or of every gunicorn
+    worker when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client is not installed\n", CONTENT_TYPE_LATEST
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+# Per-request bodies use fast levels: brotli quality 11 costs ~20 ms for a 10 KB body, quality 4 ~0.05 ms
+FAST_GZIP_LEVEL = 5
+FAST_BROTLI_QUALITY = 4
+
+
+@dataclass(frozen=True)
+class PreparedResponse:
+    """
+    A response body serialized once, with precompressed variants and a strong
+    ETag of the identity body (served with a -gzip/-br suffix for the variants).
+    """
+    body: bytes
+    gzip_body: Optional[bytes]
+    brotli_body: Optional[bytes]
+    etag: str
+    media_type: str = "application/json"
+
+
+def prepare_response(body: bytes, media_type: str = "application/json", compress: bool = True, fast: bool = False) -> PreparedResponse:
+    # compress=False skips the variants, e.g. for small per-request bodies where compression does not pay off;
+    # fast=True trades some ratio for speed, for bodies built per request rather than once per forecast run
+    gzip_level, brotli_quality = (FAST_GZIP_LEVEL, FAST_BROTLI_QUALITY) if fast else (9, 11)
+    return PreparedResponse(
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=gzip_level, mtime=0) if compress else None,
+        brotli_body=brotli.compress(body, quality=brotli_quality) if compress and brotli is not None else None,
+        etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        media_type=media_type,
+    )
+
+
+def encode_json(data: Any) -> bytes:
+    # Same encoding FastAPI's JSONResponse would produce; every prepared JSON body uses it, so equal data gets equal bytes and ETags
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def negotiate_media_type(accept: str, offered: list[str]) -> str:
+    """
+    The offered media type the Accept header prefers most (highest q, the
+    earlier offer on ties). Falls back to offered[0], the default, when the
+    header is missing or matches nothing.
+    """
+    ranges = []
+    for part in accept.split(","):
+        media_range, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_range:
+            ranges.append((media_range.lower(), q))
+
+    best, best_q = offered[0], 0.0
+    for media_type in offered:
+        main_type = media_type.split("/")[0]
+        # The most specific matching range decides the quality
+        matches = {r: q for r, q in ranges if r in (media_type, f"{main_type}/*", "*/*")}
+        q = matches.get(media_type, matches.get(f"{main_type}/*", matches.get("*/*", 0.0)))
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def _encoded_etag(etag: str, coding: Optional[str]) -> str:
+    # Each encoding is a different byte sequence, so it gets its own strong ETag: "<hash>-gzip", "<hash>-br"
+    return etag if coding is None else f'{etag[:-1]}-{coding}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as required for If-None-Match; any encoding's tag validates the same content
+    variants = {_encoded_etag(etag, coding) for coding in (None, "gzip", "br")}
+    return any(tag.removeprefix("W/") in variants for tag in candidates)
+
+
+def serve_prepared_response(request: Request, prepared: PreparedResponse, max_age: int = 0, vary: str = "Accept-Encoding") -> Response:
+    """
+    Sends a PreparedResponse, choosing the brotli/gzip variant from
+    Accept-Encoding and answering 304 when If-None-Match matches.
+    """
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    body, coding = prepared.body, None
+    if "br" in accepted and prepared.brotli_body is not None:
+        body, coding = prepared.brotli_body, "br"
+    elif "gzip" in accepted and prepared.gzip_body is not None:
+        body, coding = prepared.gzip_body, "gzip"
+
+    headers = {
+        "ETag": _encoded_etag(prepared.etag, coding),
+        "Cache-Control": f"public, max-age={max_age}",
+        "Vary": vary,
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, prepared.etag):
+        return Response(status_code=304, headers=headers)
+
+    if coding is not None:
+        headers["Content-Encoding"] = coding
+    return Response(content=body, media_type=prepared.media_type, headers=headers)
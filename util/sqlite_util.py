@@ -0,0 +1,29 @@
+import os
+import sqlite3
+from typing import Callable, Optional
+
+
+class ProcessLocalConnection:
+    """
+    A SQLite connection in WAL mode shared by the threads of one process.
+    Connections must not cross a fork, so get() reconnects in each worker
+    process and runs setup (pragmas, CREATE TABLE IF NOT EXISTS) on every new
+    connection. Callers serialize their use of it with their own lock.
+    """
+
+    def __init__(self, path: str, setup: Optional[Callable[[sqlite3.Connection], None]] = None, timeout: float = 10.0):
+        self.path = path
+        self.setup = setup
+        self.timeout = timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def get(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            if self.setup is not None:
+                self.setup(conn)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn